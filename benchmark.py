@@ -0,0 +1,356 @@
+import argparse
+import filecmp
+import heapq
+import json
+import os
+import platform
+import random
+import resource
+import struct
+import tempfile
+import time
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from huffman import ALLOWED_EXTENSIONS, BitWriter, HuffmanCompressor, HuffmanNode, TableDecoder, _encode_block
+
+# Sizes run by the suite unless --sizes is given
+DEFAULT_SUITE_SIZES = ["1K", "64K", "1M", "16M"]
+# Input sizes timed by the per-file setup microbenchmark
+SETUP_SIZES = ["256", "1K", "4K", "64K"]
+# Bytes generated per step when writing a corpus file
+CORPUS_PIECE_SIZE = 1 << 20
+
+WORDS = ["the", "report", "quarterly", "revenue", "customer", "data", "export", "value",
+         "system", "record", "update", "invoice", "region", "total", "of", "and", "for", "with"]
+
+def peak_rss_kb():
+    """Peak resident memory of this process in KB"""
+    # ru_maxrss survives fork+exec, VmHWM starts fresh in every spawned process
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def make_sample_data(size, seed=0):
+    """Generate CSV-like sample data of roughly the given size"""
+    rng = random.Random(seed)
+    lines = ["id,name,city,amount\n"]
+    total = len(lines[0])
+    names = ["alice", "bob", "carol", "dave", "erin", "frank"]
+    cities = ["London", "Lahore", "Berlin", "Tokyo", "Toronto"]
+    row = 0
+    while total < size:
+        line = f"{row},{rng.choice(names)},{rng.choice(cities)},{rng.randint(0, 99999) / 100}\n"
+        lines.append(line)
+        total += len(line)
+        row += 1
+    return "".join(lines).encode()[:size]
+
+def encode_sample(data):
+    """Encode data and return the compressor, packed payload and bit count"""
+    compressor = HuffmanCompressor()
+    frequency = compressor.build_frequency_dict(data)
+    root = compressor.build_huffman_tree(compressor.build_heap(frequency))
+    compressor.assign_canonical_codes(compressor.get_code_lengths(root))
+    encoded_text = compressor.get_encoded_data(data)
+    payload = compressor.get_byte_array(compressor.pad_encoded_text(encoded_text))
+    return compressor, bytes(payload[1:]), len(encoded_text)
+
+def bench_decode(size=1 << 20, table_bits_options=(8, 10, 12)):
+    """Compare the reference bit-by-bit decoder with the table-driven decoder"""
+    data = make_sample_data(size)
+    compressor, payload, bit_count = encode_sample(data)
+    mb = len(data) / (1024 * 1024)
+
+    encoded_text = "".join(f"{byte:08b}" for byte in payload)[:bit_count]
+    start = time.perf_counter()
+    assert compressor.decode_data(encoded_text) == data
+    elapsed = time.perf_counter() - start
+    print(f"reference decoder:      {mb / elapsed:8.2f} MB/s")
+
+    for table_bits in table_bits_options:
+        decoder = TableDecoder(compressor.reverse_mapping, table_bits)
+        start = time.perf_counter()
+        assert decoder.decode(payload, bit_count) == data
+        elapsed = time.perf_counter() - start
+        print(f"table decoder ({table_bits:2d} bits): {mb / elapsed:8.2f} MB/s")
+
+def _measure_encode(path, size):
+    """Encode sample data with one encoder path and return (baseline, peak) RSS in KB"""
+    data = make_sample_data(size)
+    compressor = HuffmanCompressor(verbose=False, engine="python")
+    frequency = compressor.build_frequency_dict(data)
+    compressor.assign_canonical_codes(compressor.build_code_lengths(frequency))
+    baseline = peak_rss_kb()
+
+    if path == "string":
+        encoded_text = compressor.get_encoded_data(data)
+        padded_encoded_text = compressor.pad_encoded_text(encoded_text)
+        compressor.get_byte_array(padded_encoded_text)
+    elif path == "block":
+        # The encoder compress runs on every chunk
+        _encode_block(compressor.codes, data)
+    else:
+        # The whole compress path, chunked and written to disk
+        with tempfile.TemporaryDirectory() as work_dir:
+            input_path = os.path.join(work_dir, "sample.csv")
+            with open(input_path, "wb") as output:
+                output.write(data)
+            del data
+            compressor.write_archive(input_path, os.path.join(work_dir, "sample.huf"))
+
+    return baseline, peak_rss_kb()
+
+def bench_encode_memory(size=16 << 20):
+    """Compare peak RSS of the bit-string encoder with the integer bit-packing encoder and compress"""
+    for path in ("string", "block", "archive"):
+        # A fresh process per path so peak RSS is not shared between runs
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+            start = time.perf_counter()
+            baseline, peak = pool.submit(_measure_encode, path, size).result()
+            elapsed = time.perf_counter() - start
+        print(f"{path:>7} encoder: peak RSS {peak / 1024:8.1f} MB "
+              f"(+{(peak - baseline) / 1024:.1f} MB over input), {elapsed:.2f}s")
+
+def _heap_code_lengths(compressor, frequency):
+    """Code lengths the way they were built before the flat tree, one node object per merge"""
+    heap = []
+    for byte_val, freq in sorted(frequency.items()):
+        heapq.heappush(heap, HuffmanNode(byte_val, freq))
+    while len(heap) > 1:
+        node1 = heapq.heappop(heap)
+        node2 = heapq.heappop(heap)
+        merged = HuffmanNode(None, node1.freq + node2.freq)
+        merged.left = node1
+        merged.right = node2
+        heapq.heappush(heap, merged)
+    return compressor.get_code_lengths(heap[0])
+
+def _time_per_call(func, min_seconds=0.2):
+    """Average seconds per call of func, repeated for at least min_seconds"""
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        func()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            return elapsed / calls
+
+def bench_setup(sizes=SETUP_SIZES):
+    """Per-file setup cost of code lengths, encoder setup and the decoder table, against a whole compress"""
+    compressor = HuffmanCompressor(verbose=False)
+    with tempfile.TemporaryDirectory() as work_dir:
+        for size in sizes:
+            data = make_sample_data(parse_size(size))
+            frequency = compressor.build_frequency_dict(data)
+            
+            def setup(build_lengths):
+                # Everything compress does before the first byte is encoded
+                compressor.assign_canonical_codes(build_lengths(compressor.build_frequency_dict(data)))
+                BitWriter(compressor.codes)
+            
+            heap_tree = _time_per_call(lambda: _heap_code_lengths(compressor, frequency))
+            flat_tree = _time_per_call(lambda: compressor.build_code_lengths(frequency))
+            heap_setup = _time_per_call(lambda: setup(lambda counts: _heap_code_lengths(compressor, counts)))
+            flat_setup = _time_per_call(lambda: setup(compressor.build_code_lengths))
+            decoder = _time_per_call(lambda: TableDecoder(compressor.reverse_mapping))
+            
+            input_path = os.path.join(work_dir, "sample.csv")
+            with open(input_path, "wb") as file:
+                file.write(data)
+            output_path = input_path + ".huf"
+            compress_file = _time_per_call(lambda: compressor.compress(input_path, output_path))
+            
+            print(f"{size:>4} ({len(frequency):3d} symbols): "
+                  f"lengths heap {heap_tree * 1e6:7.1f} us / flat {flat_tree * 1e6:7.1f} us, "
+                  f"encoder setup heap {heap_setup * 1e6:7.1f} us / flat {flat_setup * 1e6:7.1f} us, "
+                  f"decoder table {decoder * 1e6:7.1f} us, whole compress {compress_file * 1e6:8.1f} us")
+
+def parse_size(text):
+    """Parse a size such as 512, 64K, 16M or 1G into bytes"""
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    text = text.strip().upper()
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+def make_text_piece(rng, size):
+    """Generate prose-like text"""
+    words = []
+    total = 0
+    while total < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        total += len(word) + 1
+    return (" ".join(words) + ".\n").encode()
+
+def make_json_piece(rng, size):
+    """Generate JSON records in the style of an API dump"""
+    records = []
+    total = 0
+    while total < size:
+        record = json.dumps({
+            "id": rng.randint(0, 10 ** 9),
+            "name": rng.choice(WORDS),
+            "active": rng.random() < 0.5,
+            "amount": round(rng.uniform(0, 10000), 2),
+            "tags": rng.sample(WORDS, 3)
+        })
+        records.append(record)
+        total += len(record) + 2
+    return ("[" + ",\n".join(records) + "]\n").encode()
+
+def make_legacy_office_piece(rng, size):
+    """Generate records mixing UTF-16 text and binary fields like .doc/.xls files"""
+    piece = bytearray()
+    while len(piece) < size:
+        text = make_text_piece(rng, 64).decode().encode("utf-16-le")
+        piece += struct.pack("<HH", rng.randint(0, 0x3FF), len(text)) + text
+        piece += struct.pack("<dI", rng.uniform(0, 1e6), rng.getrandbits(32))
+    return bytes(piece)
+
+def write_zip_corpus(path, size, rng, members):
+    """Write an Office-like zip of XML members plus a stored binary part"""
+    with open(path, "wb") as raw, zipfile.ZipFile(raw, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", '<?xml version="1.0"?><Types/>')
+        archive.writestr("docProps/media.bin", rng.randbytes(max(size // 10, 1)), zipfile.ZIP_STORED)
+        with archive.open(members, "w") as member:
+            member.write(b'<?xml version="1.0" encoding="UTF-8"?><root>')
+            # Deflate output lags behind its input, so a second compressor flushed after every
+            # piece tracks the archive size; the central directory adds about 200 bytes
+            estimate = zlib.compressobj()
+            written = raw.tell() + 200
+            while written < size:
+                words = make_text_piece(rng, min(CORPUS_PIECE_SIZE // 4, size - written)).decode().split()
+                cells = "".join(f'<c r="A{rng.randint(1, 9999)}"><v>{word}</v></c>' for word in words).encode()
+                member.write(cells)
+                written += len(estimate.compress(cells)) + len(estimate.flush(zlib.Z_SYNC_FLUSH))
+            member.write(b"</root>")
+
+def make_corpus_file(path, extension, size, seed=0):
+    """Write a synthetic file of roughly size bytes for one supported extension"""
+    rng = random.Random(seed)
+    if extension in (".docx", ".xlsx"):
+        members = "word/document.xml" if extension == ".docx" else "xl/worksheets/sheet1.xml"
+        write_zip_corpus(path, size, rng, members)
+        return
+
+    makers = {
+        ".txt": make_text_piece,
+        ".csv": lambda rng, piece: make_sample_data(piece, rng.random()),
+        ".json": make_json_piece,
+        ".doc": make_legacy_office_piece,
+        ".xls": make_legacy_office_piece,
+    }
+    with open(path, "wb") as output:
+        written = 0
+        while written < size:
+            piece = makers[extension](rng, min(CORPUS_PIECE_SIZE, size - written))[:size - written]
+            output.write(piece)
+            written += len(piece)
+
+def _timed_run(operation, input_path, output_path, options):
+    """Run one compress or decompress and return (seconds, baseline RSS KB, peak RSS KB)"""
+    compressor = HuffmanCompressor(verbose=False, **options)
+    baseline = peak_rss_kb()
+    start = time.perf_counter()
+    success = getattr(compressor, operation)(input_path, output_path)
+    elapsed = time.perf_counter() - start
+    if not success:
+        raise RuntimeError(f"{operation} failed: {compressor.last_message}")
+    return elapsed, baseline, peak_rss_kb()
+
+def measure(operation, input_path, output_path, options):
+    """Run an operation in a fresh process so its peak memory is measured on its own"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+        return pool.submit(_timed_run, operation, input_path, output_path, options).result()
+
+def run_suite(sizes=DEFAULT_SUITE_SIZES, extensions=ALLOWED_EXTENSIONS, options=None, work_dir=None):
+    """Benchmark compress and decompress over synthetic corpora and return the results"""
+    options = options or {}
+    decompress_options = {key: value for key, value in options.items() if key in ("chunk_size", "workers")}
+    results = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "options": options,
+        "cases": []
+    }
+
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        for extension in extensions:
+            for size_text in sizes:
+                size = parse_size(size_text)
+                source = os.path.join(tmp, "corpus" + extension)
+                compressed = os.path.join(tmp, "corpus.huf")
+                restored = os.path.join(tmp, "restored" + extension)
+                make_corpus_file(source, extension, size)
+
+                original_size = os.path.getsize(source)
+                mb = original_size / (1024 * 1024)
+                compress_seconds, compress_base, compress_peak = measure("compress", source, compressed, options)
+                decompress_seconds, decompress_base, decompress_peak = measure(
+                    "decompress", compressed, restored, decompress_options)
+                compressed_size = os.path.getsize(compressed)
+
+                case = {
+                    "extension": extension,
+                    "size": size_text,
+                    "original_size": original_size,
+                    "compressed_size": compressed_size,
+                    "ratio": round(compressed_size / original_size, 4),
+                    "compress_mb_s": round(mb / compress_seconds, 3),
+                    "decompress_mb_s": round(mb / decompress_seconds, 3),
+                    "compress_peak_rss_kb": compress_peak,
+                    "compress_rss_growth_kb": compress_peak - compress_base,
+                    "decompress_peak_rss_kb": decompress_peak,
+                    "decompress_rss_growth_kb": decompress_peak - decompress_base,
+                    "round_trip_ok": filecmp.cmp(source, restored, shallow=False)
+                }
+                results["cases"].append(case)
+                print(f"{extension:>5} {size_text:>5}: ratio {case['ratio']:.3f}, "
+                      f"compress {case['compress_mb_s']:7.2f} MB/s, decompress {case['decompress_mb_s']:7.2f} MB/s, "
+                      f"peak RSS {compress_peak / 1024:.1f}/{decompress_peak / 1024:.1f} MB")
+                for path in (source, compressed, restored):
+                    os.remove(path)
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Huffman compressor benchmarks")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("decode", help="reference vs table-driven decoder throughput")
+    subparsers.add_parser("memory", help="peak RSS of the string encoder, the block encoder and compress")
+    setup_parser = subparsers.add_parser("setup", help="per-file tree and table setup cost on small inputs")
+    setup_parser.add_argument("--sizes", default=",".join(SETUP_SIZES), help="e.g. 256,1K,4K")
+    suite_parser = subparsers.add_parser("suite", help="throughput, ratio and memory over synthetic corpora")
+    suite_parser.add_argument("--sizes", default=",".join(DEFAULT_SUITE_SIZES), help="e.g. 1K,1M,1G")
+    suite_parser.add_argument("--extensions", default=",".join(ALLOWED_EXTENSIONS))
+    suite_parser.add_argument("--output", default="benchmark_results.json", help="JSON results file")
+    suite_parser.add_argument("--work-dir", default=None, help="where corpora are generated")
+    suite_parser.add_argument("--adaptive", action="store_true")
+    suite_parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    if args.command == "suite":
+        options = {"adaptive": args.adaptive, "workers": args.workers}
+        results = run_suite(args.sizes.split(","), args.extensions.split(","), options, args.work_dir)
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+        print(f"Results written to {args.output}")
+        return
+    if args.command in (None, "decode"):
+        bench_decode()
+    if args.command in (None, "memory"):
+        bench_encode_memory()
+    if args.command in (None, "setup"):
+        bench_setup(args.sizes.split(",") if args.command == "setup" else SETUP_SIZES)
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,37 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import os
+import queue
+import threading
+import time
 from huffman import HuffmanCompressor
 
 class HuffmanGUI:
     def __init__(self, root):
         self.root = root
         self.root.title("Text File Compressor")
-        self.root.geometry("550x450")
-        self.root.resizable(False, False)
+        self.root.geometry("620x700")
+        # Fits small screens, the status log takes up any extra height
+        self.root.minsize(560, 480)
+        self.root.columnconfigure(0, weight=1)
+        self.root.rowconfigure(0, weight=1)
         
         self.compressor = HuffmanCompressor()
+        # Background job state, events from the worker thread arrive through the queue
+        self.events = queue.Queue()
+        self.worker = None
+        self.cancel_event = None
+        self.job_started = None
+        self.on_job_done = None
         self.setup_ui()
+        self.root.after(100, self.poll_events)
     
     def setup_ui(self):
         # Main frame
-        main_frame = ttk.Frame(self.root, padding="20")
+        main_frame = ttk.Frame(self.root, padding="10")
         main_frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        main_frame.columnconfigure(0, weight=1)
+        main_frame.rowconfigure(6, weight=1)
 
         # Title
         title_label = ttk.Label(main_frame, text="Text File Compressor", 
@@ -27,11 +42,11 @@ class HuffmanGUI:
         subtitle_label = ttk.Label(main_frame, 
                                    text="Supports: TXT, CSV, JSON, DOCX, XLSX (Text-based files only)", 
                                    font=("Arial", 9), foreground="gray")
-        subtitle_label.grid(row=1, column=0, columnspan=2, pady=(0, 15))
+        subtitle_label.grid(row=1, column=0, columnspan=2, pady=(0, 10))
         
          # Compression section
         compress_frame = ttk.LabelFrame(main_frame, text="Compress File", padding="10")
-        compress_frame.grid(row=2, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(0, 10))
+        compress_frame.grid(row=2, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(0, 5))
         
         ttk.Label(compress_frame, text="Input File:").grid(row=0, column=0, sticky=tk.W, pady=5)
         self.compress_input_entry = ttk.Entry(compress_frame, width=50)
@@ -45,12 +60,16 @@ class HuffmanGUI:
         ttk.Button(compress_frame, text="Browse", 
                   command=self.browse_compress_output).grid(row=1, column=2, padx=5)
         
+        self.lz77_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(compress_frame, text="LZ77 pre-pass (smaller output for repetitive data, slower)",
+                        variable=self.lz77_var).grid(row=2, column=1, sticky=tk.W, pady=(5, 0))
+        
         ttk.Button(compress_frame, text="Compress", 
-                  command=self.compress_file).grid(row=2, column=1, pady=10)
+                  command=self.compress_file).grid(row=3, column=1, pady=5)
         
          # Decompression section
         decompress_frame = ttk.LabelFrame(main_frame, text="Decompress File", padding="10")
-        decompress_frame.grid(row=3, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(10, 10))
+        decompress_frame.grid(row=3, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(5, 5))
         
         ttk.Label(decompress_frame, text="Input File:").grid(row=0, column=0, sticky=tk.W, pady=5)
         self.decompress_input_entry = ttk.Entry(decompress_frame, width=50)
@@ -65,19 +84,54 @@ class HuffmanGUI:
                   command=self.browse_decompress_output).grid(row=1, column=2, padx=5)
         
         ttk.Button(decompress_frame, text="Decompress", 
-                  command=self.decompress_file).grid(row=2, column=1, pady=10)
+                  command=self.decompress_file).grid(row=2, column=1, pady=5)
+        ttk.Button(decompress_frame, text="Verify", 
+                  command=self.verify_file).grid(row=2, column=2, padx=5)
+        
+        # Multi-file archive section
+        archive_frame = ttk.LabelFrame(main_frame, text="Archive", padding="10")
+        archive_frame.grid(row=4, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(5, 0))
+        
+        ttk.Label(archive_frame, text="Archive:").grid(row=0, column=0, sticky=tk.W, pady=5)
+        self.archive_entry = ttk.Entry(archive_frame, width=50)
+        self.archive_entry.grid(row=0, column=1, padx=5, pady=5)
+        ttk.Button(archive_frame, text="Browse", 
+                  command=self.browse_archive).grid(row=0, column=2, padx=5)
+        
+        self.archive_list = tk.Listbox(archive_frame, height=4, width=50, selectmode=tk.EXTENDED)
+        self.archive_list.grid(row=1, column=1, padx=5, pady=5)
+        archive_buttons = ttk.Frame(archive_frame)
+        archive_buttons.grid(row=1, column=2, sticky=tk.N, pady=5)
+        ttk.Button(archive_buttons, text="Add files...", 
+                  command=self.add_to_archive).grid(row=0, column=0, padx=5, pady=(0, 5), sticky=(tk.W, tk.E))
+        ttk.Button(archive_buttons, text="Extract selected", 
+                  command=self.extract_selected).grid(row=1, column=0, padx=5, sticky=(tk.W, tk.E))
         
-        # # Status section
-        # status_frame = ttk.LabelFrame(main_frame, text="Status", padding="10")
-        # status_frame.grid(row=4, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(10, 0))
+        # Progress section
+        progress_frame = ttk.LabelFrame(main_frame, text="Progress", padding="10")
+        progress_frame.grid(row=5, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(5, 0))
         
-        # self.status_text = tk.Text(status_frame, height=8, width=60, state=tk.DISABLED)
-        # self.status_text.grid(row=0, column=0, sticky=(tk.W, tk.E))
+        self.progress_bar = ttk.Progressbar(progress_frame, length=420, mode='determinate', maximum=100)
+        self.progress_bar.grid(row=0, column=0, padx=5, pady=5)
+        self.cancel_button = ttk.Button(progress_frame, text="Cancel", 
+                                        command=self.cancel_job, state=tk.DISABLED)
+        self.cancel_button.grid(row=0, column=1, padx=5)
+        self.progress_label = ttk.Label(progress_frame, text="Idle")
+        self.progress_label.grid(row=1, column=0, columnspan=2, sticky=tk.W, padx=5)
         
-        # # Scrollbar for status text
-        # scrollbar = ttk.Scrollbar(status_frame, orient=tk.VERTICAL, command=self.status_text.yview)
-        # scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
-        # self.status_text.configure(yscrollcommand=scrollbar.set)
+        # Status section
+        status_frame = ttk.LabelFrame(main_frame, text="Status", padding="10")
+        status_frame.grid(row=6, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(5, 0))
+        status_frame.columnconfigure(0, weight=1)
+        status_frame.rowconfigure(0, weight=1)
+        
+        self.status_text = tk.Text(status_frame, height=5, width=60, state=tk.DISABLED)
+        self.status_text.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        
+        # Scrollbar for status text
+        scrollbar = ttk.Scrollbar(status_frame, orient=tk.VERTICAL, command=self.status_text.yview)
+        scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        self.status_text.configure(yscrollcommand=scrollbar.set)
         
     def browse_compress_input(self):
         filename = filedialog.askopenfilename(
@@ -145,15 +199,122 @@ class HuffmanGUI:
             self.decompress_output_entry.delete(0, tk.END)
             self.decompress_output_entry.insert(0, filename)
 
+    def browse_archive(self):
+        filename = filedialog.asksaveasfilename(
+            title="Select or create an archive",
+            defaultextension=".hufa",
+            confirmoverwrite=False,
+            filetypes=[("Huffman archives", "*.hufa"), ("All files", "*.*")]
+        )
+        if filename:
+            self.archive_entry.delete(0, tk.END)
+            self.archive_entry.insert(0, filename)
+            self.refresh_archive_members()
+    
+    def refresh_archive_members(self):
+        """Fill the member list from the archive's central directory"""
+        self.archive_list.delete(0, tk.END)
+        archive = self.archive_entry.get()
+        if not archive or not os.path.exists(archive):
+            return
+        try:
+            members = self.compressor.list_archive(archive)
+        except (OSError, ValueError) as e:
+            self.log_status(f"✗ Error: {e}")
+            return
+        for member in members:
+            self.archive_list.insert(tk.END, member['name'])
+    
     def log_status(self, message):
         """Add message to status text area"""
         self.status_text.configure(state=tk.NORMAL)
         self.status_text.insert(tk.END, message + "\n")
         self.status_text.see(tk.END)
         self.status_text.configure(state=tk.DISABLED)
-        self.root.update()
+    
+    def job_running(self):
+        """Warn and return True while a background job is still running"""
+        if self.worker is not None and self.worker.is_alive():
+            messagebox.showwarning("Busy", "Please wait for the current job to finish or cancel it")
+            return True
+        return False
+    
+    def start_job(self, job, on_done, **options):
+        """Run job(compressor) on a worker thread, on_done(success) runs on the Tk thread"""
+        self.cancel_event = threading.Event()
+        compressor = HuffmanCompressor(verbose=False, progress=self.queue_progress,
+                                       cancel_event=self.cancel_event, **options)
+        self.on_job_done = on_done
+        self.job_started = time.perf_counter()
+        self.progress_bar['value'] = 0
+        self.progress_label.configure(text="Starting...")
+        self.cancel_button.configure(state=tk.NORMAL)
+        
+        def run():
+            try:
+                success = job(compressor)
+                # Per-stage timings of the last call, shown in the status log
+                stages = compressor.last_stats.report() if compressor.last_stats else []
+                self.events.put(('done', success, compressor.last_message, stages))
+            except Exception as e:
+                self.events.put(('error', str(e)))
+        
+        self.worker = threading.Thread(target=run, daemon=True)
+        self.worker.start()
+    
+    def queue_progress(self, stage, done, total):
+        """Progress callback, runs on the worker thread"""
+        self.events.put(('progress', stage, done, total))
+    
+    def cancel_job(self):
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+            self.progress_label.configure(text="Cancelling...")
+    
+    def poll_events(self):
+        """Apply events sent by the worker thread, rescheduled with root.after"""
+        try:
+            while True:
+                event = self.events.get_nowait()
+                if event[0] == 'progress':
+                    _, stage, done, total = event
+                    elapsed = time.perf_counter() - self.job_started
+                    speed = done / (1024 * 1024) / elapsed if elapsed else 0
+                    self.progress_bar['value'] = 100 * done / total if total else 0
+                    self.progress_label.configure(
+                        text=f"{stage}: {done / (1024 * 1024):.1f} / {total / (1024 * 1024):.1f} MB ({speed:.2f} MB/s)"
+                    )
+                else:
+                    self.finish_job(event)
+        except queue.Empty:
+            pass
+        self.root.after(100, self.poll_events)
+    
+    def finish_job(self, event):
+        self.cancel_button.configure(state=tk.DISABLED)
+        elapsed = time.perf_counter() - self.job_started
+        cancelled = self.cancel_event.is_set() and not (event[0] == 'done' and event[1])
+        self.progress_label.configure(text=f"{'Cancelled' if cancelled else 'Finished'} after {elapsed:.2f}s")
+        
+        if event[0] == 'error':
+            self.log_status(f"✗ Error: {event[1]}")
+            messagebox.showerror("Error", f"Operation failed:\n{event[1]}")
+        elif cancelled:
+            self.log_status("✗ Cancelled")
+            self.log_status("=" * 50)
+        else:
+            if not event[1] and event[2]:
+                self.log_status(f"✗ {event[2]}")
+            if event[1] and event[3]:
+                self.log_status("Time per stage:")
+                for line in event[3]:
+                    self.log_status(f"  {line}")
+            self.on_job_done(event[1])
     
     def compress_file(self):
+        if self.job_running():
+            return
+
         input_file = self.compress_input_entry.get()
         output_file = self.compress_output_entry.get()
 
@@ -165,31 +326,29 @@ class HuffmanGUI:
             messagebox.showerror("Error", "Input file does not exist")
             return
 
-        try:
-            # ✅ Always use a fresh compressor instance
-            compressor = HuffmanCompressor()
-
-            # Log info
-            file_size = os.path.getsize(input_file)
-            file_ext = os.path.splitext(input_file)[1].upper()
-
-            allowed_extensions = ['.TXT', '.CSV', '.JSON', '.DOCX', '.DOC', '.XLSX', '.XLS']
-            if file_ext not in allowed_extensions:
-                messagebox.showerror(
-                    "Error",
-                    f"File type {file_ext} is not supported!\n\n"
-                    f"Supported types: TXT, CSV, JSON, DOCX, DOC, XLSX, XLS"
-                )
-                self.log_status(f"✗ Error: Unsupported file type {file_ext}")
-                return
-
-            self.log_status(f"Starting compression...")
-            self.log_status(f"File: {os.path.basename(input_file)} ({file_ext})")
-            self.log_status(f"Size: {file_size:,} bytes")
-            self.log_status("-" * 50)
+        # Log info
+        file_size = os.path.getsize(input_file)
+        file_ext = os.path.splitext(input_file)[1].upper()
+
+        allowed_extensions = ['.TXT', '.CSV', '.JSON', '.DOCX', '.DOC', '.XLSX', '.XLS']
+        if file_ext not in allowed_extensions:
+            messagebox.showerror(
+                "Error",
+                f"File type {file_ext} is not supported!\n\n"
+                f"Supported types: TXT, CSV, JSON, DOCX, DOC, XLSX, XLS"
+            )
+            self.log_status(f"✗ Error: Unsupported file type {file_ext}")
+            return
 
-            success = compressor.compress(input_file, output_file)
+        self.log_status(f"Starting compression...")
+        self.log_status(f"File: {os.path.basename(input_file)} ({file_ext})")
+        self.log_status(f"Size: {file_size:,} bytes")
+        lz77 = self.lz77_var.get()
+        if lz77:
+            self.log_status("Mode: LZ77 + Huffman")
+        self.log_status("-" * 50)
 
+        def on_done(success):
             if success:
                 compressed_size = os.path.getsize(output_file)
                 ratio = (1 - compressed_size / file_size) * 100
@@ -203,11 +362,14 @@ class HuffmanGUI:
                 )
             else:
                 self.log_status("✗ Compression failed!")
-        except Exception as e:
-            self.log_status(f"✗ Error during compression: {str(e)}")
-            messagebox.showerror("Error", f"Compression failed: {str(e)}")
+
+        # ✅ Always use a fresh compressor instance, run off the Tk thread
+        self.start_job(lambda compressor: compressor.compress(input_file, output_file), on_done, lz77=lz77)
 
     def decompress_file(self):
+        if self.job_running():
+            return
+
         input_file = self.decompress_input_entry.get()
         output_file = self.decompress_output_entry.get()
 
@@ -219,17 +381,11 @@ class HuffmanGUI:
             messagebox.showerror("Error", "Input file does not exist")
             return
 
-        try:
-            # ✅ Always use a fresh compressor instance
-            compressor = HuffmanCompressor()
-
-            self.log_status(f"Starting decompression...")
-            self.log_status(f"File: {os.path.basename(input_file)}")
-            self.log_status("-" * 50)
-
-            # Run decompression
-            success = compressor.decompress(input_file, output_file)
+        self.log_status(f"Starting decompression...")
+        self.log_status(f"File: {os.path.basename(input_file)}")
+        self.log_status("-" * 50)
 
+        def on_done(success):
             if success:
                 # The decompressor might change or append the extension automatically
                 actual_output = output_file
@@ -259,121 +415,103 @@ class HuffmanGUI:
                     messagebox.showinfo("Success", "File decompressed successfully!")
             else:
                 self.log_status("✗ Decompression failed!")
-        except Exception as e:
-            self.log_status(f"✗ Error during decompression: {str(e)}")
-            messagebox.showerror("Error", f"Decompression failed:\n{str(e)}")
 
-def decompress_file(self):
+        # ✅ Always use a fresh compressor instance, run off the Tk thread
+        self.start_job(lambda compressor: compressor.decompress(input_file, output_file), on_done)
+
+    def verify_file(self):
+        if self.job_running():
+            return
+
         input_file = self.decompress_input_entry.get()
-        output_file = self.decompress_output_entry.get()
 
-        if not input_file or not output_file:
-            messagebox.showerror("Error", "Please select both input and output files")
+        if not input_file or not os.path.exists(input_file):
+            messagebox.showerror("Error", "Please select an existing compressed file")
             return
 
-        if not os.path.exists(input_file):
-            messagebox.showerror("Error", "Input file does not exist")
+        self.log_status(f"Verifying {os.path.basename(input_file)}...")
+
+        def on_done(success):
+            if success:
+                self.log_status(f"✓ {self.last_verify_message}")
+                self.log_status("=" * 50)
+                messagebox.showinfo("Verify", "Archive is intact")
+            else:
+                self.log_status("✗ Archive is damaged!")
+                messagebox.showerror("Verify", "Archive is damaged, see the status log")
+
+        def job(compressor):
+            success = compressor.verify(input_file)
+            self.last_verify_message = compressor.last_message
+            return success
+
+        self.start_job(job, on_done)
+
+    def add_to_archive(self):
+        if self.job_running():
             return
 
-        try:
-            # ✅ Always use a fresh compressor instance
-            compressor = HuffmanCompressor()
+        archive = self.archive_entry.get()
+        if not archive:
+            messagebox.showerror("Error", "Please select an archive")
+            return
 
-            self.log_status(f"Starting decompression...")
-            self.log_status(f"File: {os.path.basename(input_file)}")
-            self.log_status("-" * 50)
+        input_files = filedialog.askopenfilenames(
+            title="Select files to add",
+            filetypes=[
+                ("All supported files", "*.txt *.csv *.json *.docx *.doc *.xlsx *.xls"),
+                ("All files", "*.*")
+            ]
+        )
+        if not input_files:
+            return
 
-            # Run decompression
-            success = compressor.decompress(input_file, output_file)
+        self.log_status(f"Adding {len(input_files)} files to {os.path.basename(archive)}...")
+        self.log_status("-" * 50)
 
+        def on_done(success):
+            self.refresh_archive_members()
             if success:
-                # The decompressor might change or append the extension automatically
-                actual_output = output_file
-                if not os.path.exists(actual_output):
-                    # Try with added original extension
-                    base, ext = os.path.splitext(output_file)
-                    for f in os.listdir(os.path.dirname(output_file) or '.'):
-                        if os.path.splitext(f)[0] == os.path.basename(base):
-                            actual_output = os.path.join(os.path.dirname(output_file), f)
-                            break
-
-                if os.path.exists(actual_output):
-                    decompressed_size = os.path.getsize(actual_output)
-                    self.log_status(f"✓ Decompression successful!")
-                    self.log_status(f"Output: {os.path.basename(actual_output)}")
-                    self.log_status(f"Size: {decompressed_size:,} bytes")
-                    self.log_status(f"Location: {actual_output}")
-                    self.log_status("=" * 50)
-                    messagebox.showinfo(
-                        "Success",
-                        f"File decompressed successfully!\n\nSaved as:\n"
-                        f"{os.path.basename(actual_output)}\n\nLocation:\n{actual_output}"
-                    )
-                else:
-                    self.log_status(f"✓ Decompression completed!")
-                    self.log_status("=" * 50)
-                    messagebox.showinfo("Success", "File decompressed successfully!")
+                self.log_status(f"✓ Archive now holds {self.archive_list.size()} files")
+                self.log_status(f"Archive size: {os.path.getsize(archive):,} bytes")
+                self.log_status("=" * 50)
             else:
-                self.log_status("✗ Decompression failed!")
-        except Exception as e:
-            self.log_status(f"✗ Error during decompression: {str(e)}")
-            messagebox.showerror("Error", f"Decompression failed:\n{str(e)}")
+                self.log_status("✗ Adding files failed!")
 
+        self.start_job(lambda compressor: compressor.add_to_archive(archive, list(input_files), share_tables=True),
+                       on_done, lz77=self.lz77_var.get())
 
-def decompress_file(self):
-        input_file = self.decompress_input_entry.get()
-        output_file = self.decompress_output_entry.get()
+    def extract_selected(self):
+        if self.job_running():
+            return
 
-        if not input_file or not output_file:
-            messagebox.showerror("Error", "Please select both input and output files")
+        archive = self.archive_entry.get()
+        if not archive or not os.path.exists(archive):
+            messagebox.showerror("Error", "Please select an existing archive")
             return
 
-        if not os.path.exists(input_file):
-            messagebox.showerror("Error", "Input file does not exist")
+        names = [self.archive_list.get(index) for index in self.archive_list.curselection()]
+        if not names:
+            messagebox.showerror("Error", "Please select the files to extract")
             return
-        try:
-            # ✅ Always use a fresh compressor instance
-            compressor = HuffmanCompressor()
 
-            self.log_status(f"Starting decompression...")
-            self.log_status(f"File: {os.path.basename(input_file)}")
-            self.log_status("-" * 50)
+        output_dir = filedialog.askdirectory(title="Extract to folder")
+        if not output_dir:
+            return
 
-            # Run decompression
-            success = compressor.decompress(input_file, output_file)
+        self.log_status(f"Extracting {len(names)} files to {output_dir}...")
+        self.log_status("-" * 50)
 
+        def on_done(success):
             if success:
-                # The decompressor might change or append the extension automatically
-                actual_output = output_file
-                if not os.path.exists(actual_output):
-                    # Try with added original extension
-                    base, ext = os.path.splitext(output_file)
-                    for f in os.listdir(os.path.dirname(output_file) or '.'):
-                        if os.path.splitext(f)[0] == os.path.basename(base):
-                            actual_output = os.path.join(os.path.dirname(output_file), f)
-                            break
-
-                if os.path.exists(actual_output):
-                    decompressed_size = os.path.getsize(actual_output)
-                    self.log_status(f"✓ Decompression successful!")
-                    self.log_status(f"Output: {os.path.basename(actual_output)}")
-                    self.log_status(f"Size: {decompressed_size:,} bytes")
-                    self.log_status(f"Location: {actual_output}")
-                    self.log_status("=" * 50)
-                    messagebox.showinfo(
-                        "Success",
-                        f"File decompressed successfully!\n\nSaved as:\n"
-                        f"{os.path.basename(actual_output)}\n\nLocation:\n{actual_output}"
-                    )
-                else:
-                    self.log_status(f"✓ Decompression completed!")
-                    self.log_status("=" * 50)
-                    messagebox.showinfo("Success", "File decompressed successfully!")
+                self.log_status(f"✓ Extracted {len(names)} files")
+                self.log_status(f"Location: {output_dir}")
+                self.log_status("=" * 50)
+                messagebox.showinfo("Success", f"Extracted {len(names)} files to\n{output_dir}")
             else:
-                self.log_status("✗ Decompression failed!")
-        except Exception as e:
-            self.log_status(f"✗ Error during decompression: {str(e)}")
-            messagebox.showerror("Error", f"Decompression failed:\n{str(e)}")
+                self.log_status("✗ Extraction failed!")
+
+        self.start_job(lambda compressor: compressor.extract_from_archive(archive, output_dir, names), on_done)
 
 
 # Main application
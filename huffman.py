@@ -1,9 +1,136 @@
+import argparse
+import asyncio
+import cProfile
+import hashlib
 import heapq
+import io
+import json
+import math
+import mmap
 import os
 import pickle
-from collections import Counter, defaultdict
+import pstats
+import struct
+import sys
+import time
+import tracemalloc
+import zlib
+from bisect import bisect_right
+from collections import Counter, OrderedDict, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache, partial, wraps
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Number of bits resolved per lookup by the table-driven decoder
+DEFAULT_TABLE_BITS = 12
+
+# Longest code built by default, keeps decode tables small and code tables nibble-packed
+DEFAULT_MAX_CODE_LENGTH = 15
+
+# Bytes read per step when streaming files through compress/decompress
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+class CompressionCancelled(Exception):
+    """Raised between chunks when a compressor's cancel_event is set"""
+
+# Code tables kept by CodeTableCache and how much worse than a fresh table a cached one may be
+DEFAULT_TABLE_CACHE_SIZE = 64
+TABLE_CACHE_TOLERANCE = 0.03
+# Bytes of the table hash stored in headers that reference a shared table
+TABLE_ID_SIZE = 8
+
+# Multi-file archives: members are complete containers followed by a central directory
+ARCHIVE_MAGIC = b'HUFA'
+ARCHIVE_VERSION = 1
+# magic, version
+ARCHIVE_HEADER_STRUCT = struct.Struct('<4sB')
+# member count, shared table count
+DIRECTORY_STRUCT = struct.Struct('<II')
+# container offset, container length, original size, CRC32 of original data, name length
+MEMBER_STRUCT = struct.Struct('<QQQIH')
+# The archive ends with TRAILER_STRUCT pointing at the directory instead of a block index
+DIRECTORY_MAGIC = b'HUFC'
+
+# Trained dictionary files
+DICTIONARY_MAGIC = b'HUFD'
+DICTIONARY_VERSION = 1
+# Files up to this size skip tree building when a trained table matches their type, they are still counted
+DICTIONARY_MAX_FILE_SIZE = 16 * 1024
+
+# Symbols packed per step by the NumPy engine, bounds its temporary bit arrays
+NUMPY_PACK_SYMBOLS = 1 << 16
+# Longest code the NumPy engine packs, longer codes do not fit its uint64 code values
+NUMPY_MAX_CODE_LENGTH = 63
+
+# File types compress accepts
+ALLOWED_EXTENSIONS = ['.txt', '.csv', '.json', '.docx', '.doc', '.xlsx', '.xls']
+# Append mode is meant for growing logs, which are usually named .log
+APPEND_EXTENSIONS = ALLOWED_EXTENSIONS + ['.log']
+
+# Binary container format
+MAGIC = b'HUFZ'
+# Version 2 added a CRC32 of the original data to every block
+FORMAT_VERSION = 2
+# magic, version, flags, original size, CRC32 of original data, block count
+HEADER_STRUCT = struct.Struct('<4sBBQII')
+# original length, encoded bit count
+BLOCK_STRUCT = struct.Struct('<IQ')
+# original length, encoded bit count, CRC32 of original data
+BLOCK_CRC_STRUCT = struct.Struct('<IQI')
+# compressed offset of the block, original offset of its data
+INDEX_ENTRY_STRUCT = struct.Struct('<QQ')
+# offset of the block index, index magic
+TRAILER_STRUCT = struct.Struct('<Q4s')
+INDEX_MAGIC = b'HUFI'
+# Header flags
+FLAG_NIBBLE_LENGTHS = 0x01
+FLAG_BLOCK_INDEX = 0x02
+FLAG_ADAPTIVE = 0x04
+FLAG_SHARED_TABLE = 0x08
+
+# Block kinds, adaptive archives store one before every block
+BLOCK_SHARED = 0
+BLOCK_TABLE = 1
+BLOCK_REUSE = 2
+BLOCK_RAW = 3
+BLOCK_END = 4
+# kind, original length, encoded bit count
+ADAPTIVE_BLOCK_STRUCT = struct.Struct('<BIQ')
+# kind, original length, encoded bit count, CRC32 of original data
+ADAPTIVE_BLOCK_CRC_STRUCT = struct.Struct('<BIQI')
+# original size, CRC32 of original data, block count, after the BLOCK_END marker of a streamed archive
+STREAM_FOOTER_STRUCT = struct.Struct('<QII')
+# Reuse the previous block's table when it costs at most this much more than a new one
+ADAPTIVE_REUSE_TOLERANCE = 0.02
+
+# LZ77 archives Huffman-code a token stream per block instead of the bytes themselves
+FLAG_LZ77 = 0x10
+# Streamed archives cannot patch their header, the totals follow a BLOCK_END marker instead
+FLAG_STREAMED = 0x20
+# Incompressible input is stored as is, without a code table
+FLAG_STORED = 0x40
+KNOWN_FLAGS = (FLAG_NIBBLE_LENGTHS | FLAG_BLOCK_INDEX | FLAG_ADAPTIVE | FLAG_SHARED_TABLE | FLAG_LZ77
+               | FLAG_STREAMED | FLAG_STORED)
+# Files and blocks whose entropy estimate promises a smaller saving than this are stored raw
+DEFAULT_MIN_SAVING = 0.02
+# Tokens come in groups of eight behind a flag byte, a set bit marks a match stored as
+# length - LZ77_MIN_MATCH in one byte and distance - 1 in two little-endian bytes
+LZ77_MIN_MATCH = 3
+LZ77_MAX_MATCH = 258
+LZ77_MAX_WINDOW = 1 << 16
+DEFAULT_LZ77_WINDOW = 1 << 15
+# Earlier positions with the same 3-byte prefix tried per match
+DEFAULT_LZ77_EFFORT = 16
 
 class HuffmanNode:
+    """Tree node, built as a view over the flat arrays of build_flat_tree"""
+    __slots__ = ('char', 'freq', 'left', 'right')
+    
     def __init__(self, char, freq):
         self.char = char
         self.freq = freq
@@ -13,50 +140,842 @@ class HuffmanNode:
     def __lt__(self, other):
         return self.freq < other.freq
     
+class TableDecoder:
+    """Decode Huffman payloads several bits at a time using a lookup table"""
+    def __init__(self, reverse_mapping, table_bits=DEFAULT_TABLE_BITS):
+        self.table_bits = table_bits
+        size = 1 << table_bits
+        mask = size - 1
+        # Single-symbol table: entry packs (symbol << 8) | code length, 0 marks a long code
+        self.table = [0] * size
+        self.long_codes = {}
+        
+        for code, symbol in reverse_mapping.items():
+            length = len(code)
+            value = int(code, 2)
+            if length <= table_bits:
+                shift = table_bits - length
+                start = value << shift
+                entry = (symbol << 8) | length
+                for index in range(start, start + (1 << shift)):
+                    self.table[index] = entry
+            else:
+                self.long_codes[(length, value)] = symbol
+        
+        max_length = max((len(code) for code in reverse_mapping), default=0)
+        self.guard_bytes = max_length // 8 + 9
+        
+        # Multi-symbol table: every complete code inside table_bits bits is resolved at once
+        self.outputs = [b""] * size
+        self.used_bits = [0] * size
+        for index in range(size):
+            used = 0
+            out = bytearray()
+            while used < table_bits:
+                entry = self.table[(index << used) & mask]
+                if not entry or (entry & 0xFF) > table_bits - used:
+                    break
+                out.append(entry >> 8)
+                used += entry & 0xFF
+            self.outputs[index] = bytes(out)
+            self.used_bits[index] = used
+    
+    def decode(self, payload, bit_count):
+        """Decode the first bit_count bits of payload to original bytes"""
+        return b"".join(self.iter_decode([payload], bit_count))
+    
+    def iter_decode(self, chunks, bit_count):
+        """Decode payload chunks one at a time, yielding the decoded bytes of each"""
+        # Decoder state carried between chunks: bit buffer, buffered bits, bits left to decode
+        state = [0, 0, bit_count]
+        for chunk in chunks:
+            yield self._decode_chunk(chunk, state, False)
+        yield self._decode_chunk(b"", state, True)
+    
+    def _decode_chunk(self, payload, state, final):
+        """Decode as much of payload as possible, buffering leftover bits in state"""
+        table = self.table
+        outputs = self.outputs
+        used_bits = self.used_bits
+        table_bits = self.table_bits
+        mask = (1 << table_bits) - 1
+        decoded_data = bytearray()
+        
+        acc, acc_bits, remaining = state
+        pos = 0
+        end = len(payload)
+        # Leave enough bytes unread so a long code never runs off the end of a chunk
+        limit = end if final else end - self.guard_bytes
+        
+        # Fast path: at least table_bits real bits remain so every resolved symbol is real
+        while remaining >= table_bits and pos <= limit:
+            if acc_bits < table_bits:
+                chunk = payload[pos:pos + 8]
+                pos += len(chunk)
+                acc = ((acc & ((1 << acc_bits) - 1)) << (8 * len(chunk))) | int.from_bytes(chunk, 'big')
+                acc_bits += 8 * len(chunk)
+            
+            peek = (acc >> (acc_bits - table_bits)) & mask
+            used = used_bits[peek]
+            if used:
+                decoded_data += outputs[peek]
+            else:
+                used, symbol = self._decode_long(payload, pos, acc, acc_bits, remaining)
+                pos, acc, acc_bits = self._skip_bits(payload, pos, acc, acc_bits, used)
+                decoded_data.append(symbol)
+            
+            acc_bits -= used
+            remaining -= used
+        
+        if not final:
+            # Buffer the unread bytes for the next chunk
+            rest = payload[pos:]
+            acc = ((acc & ((1 << acc_bits) - 1)) << (8 * len(rest))) | int.from_bytes(rest, 'big')
+            acc_bits += 8 * len(rest)
+            state[:] = [acc, acc_bits, remaining]
+            return bytes(decoded_data)
+        
+        # Tail: one symbol at a time so padding bits are never decoded
+        while remaining > 0:
+            if acc_bits < table_bits:
+                chunk = payload[pos:pos + 8]
+                pos += len(chunk)
+                acc = ((acc & ((1 << acc_bits) - 1)) << (8 * len(chunk))) | int.from_bytes(chunk, 'big')
+                acc_bits += 8 * len(chunk)
+            
+            if acc_bits >= table_bits:
+                peek = (acc >> (acc_bits - table_bits)) & mask
+            else:
+                peek = (acc << (table_bits - acc_bits)) & mask
+            
+            entry = table[peek]
+            if not entry or (entry & 0xFF) > remaining:
+                raise ValueError("Corrupt data: code runs past end of payload")
+            decoded_data.append(entry >> 8)
+            acc_bits -= entry & 0xFF
+            remaining -= entry & 0xFF
+        
+        state[:] = [acc, acc_bits, remaining]
+        return bytes(decoded_data)
+    
+    def _skip_bits(self, payload, pos, acc, acc_bits, length):
+        """Make sure at least length bits are buffered"""
+        while acc_bits < length:
+            acc = ((acc & ((1 << acc_bits) - 1)) << 8) | payload[pos]
+            acc_bits += 8
+            pos += 1
+        return pos, acc, acc_bits
+    
+    def _decode_long(self, payload, pos, acc, acc_bits, remaining):
+        """Resolve a code longer than table_bits one bit at a time"""
+        length = self.table_bits
+        while length < remaining:
+            length += 1
+            while acc_bits < length:
+                if pos >= len(payload):
+                    raise ValueError("Corrupt data: code runs past end of payload")
+                acc = ((acc & ((1 << acc_bits) - 1)) << 8) | payload[pos]
+                acc_bits += 8
+                pos += 1
+            value = (acc >> (acc_bits - length)) & ((1 << length) - 1)
+            symbol = self.long_codes.get((length, value))
+            if symbol is not None:
+                return length, symbol
+        raise ValueError("Corrupt data: invalid Huffman code")
+
+class BitWriter:
+    """Pack variable-length codes into bytes from an integer accumulator"""
+    def __init__(self, codes):
+        self.values = [0] * 256
+        self.lengths = [0] * 256
+        for byte_val, code in codes.items():
+            self.values[byte_val] = int(code, 2)
+            self.lengths[byte_val] = len(code)
+        self.acc = 0
+        self.acc_bits = 0
+    
+    def encode(self, data, bit_count=None):
+        """Encode data and return the complete bytes, leftover bits stay buffered"""
+        values = self.values
+        lengths = self.lengths
+        acc = self.acc
+        acc_bits = self.acc_bits
+        
+        if bit_count is None:
+            bit_count = len(data) * max(lengths)
+        buffer = bytearray((acc_bits + bit_count) // 8 + 8)
+        pos = 0
+        
+        for byte_val in data:
+            length = lengths[byte_val]
+            acc = (acc << length) | values[byte_val]
+            acc_bits += length
+            if acc_bits >= 32:
+                nbytes = acc_bits >> 3
+                acc_bits &= 7
+                buffer[pos:pos + nbytes] = (acc >> acc_bits).to_bytes(nbytes, 'big')
+                pos += nbytes
+                acc &= (1 << acc_bits) - 1
+        
+        nbytes = acc_bits >> 3
+        if nbytes:
+            acc_bits &= 7
+            buffer[pos:pos + nbytes] = (acc >> acc_bits).to_bytes(nbytes, 'big')
+            pos += nbytes
+            acc &= (1 << acc_bits) - 1
+        
+        self.acc = acc
+        self.acc_bits = acc_bits
+        del buffer[pos:]
+        return buffer
+    
+    def flush(self):
+        """Return the buffered leftover bits padded with zeros to a whole byte"""
+        if not self.acc_bits:
+            return bytearray()
+        last = bytearray([(self.acc << (8 - self.acc_bits)) & 0xFF])
+        self.acc = 0
+        self.acc_bits = 0
+        return last
+
+class LZ77Coder:
+    """Hash-chain LZ77 match finder turning bytes into literal and match tokens"""
+    def __init__(self, window=DEFAULT_LZ77_WINDOW, effort=DEFAULT_LZ77_EFFORT):
+        self.check_settings(window, effort)
+        self.window = window
+        self.effort = effort
+    
+    @staticmethod
+    def check_settings(window, effort):
+        """Raise ValueError unless window and effort are usable"""
+        if not 0 < window <= LZ77_MAX_WINDOW:
+            raise ValueError(f"LZ77 window must be between 1 and {LZ77_MAX_WINDOW} bytes")
+        if effort < 1:
+            raise ValueError("LZ77 effort must be at least 1")
+    
+    def encode(self, data):
+        """Convert data to a token stream, matches never reach before its start"""
+        data = bytes(data)
+        size = len(data)
+        window = self.window
+        effort = self.effort
+        tokens = bytearray()
+        # Most recent position of every 3-byte prefix, and the previous one for each position
+        head = {}
+        chain = [-1] * size
+        flag_pos = 0
+        flag_bit = 8
+        
+        i = 0
+        while i < size:
+            if flag_bit == 8:
+                flag_pos = len(tokens)
+                tokens.append(0)
+                flag_bit = 0
+            
+            best_length = 0
+            best_distance = 0
+            if i + LZ77_MIN_MATCH <= size:
+                key = data[i:i + LZ77_MIN_MATCH]
+                candidate = head.get(key, -1)
+                chain[i] = candidate
+                head[key] = i
+                max_length = min(LZ77_MAX_MATCH, size - i)
+                lowest = i - window
+                tries = effort
+                while candidate >= lowest and candidate >= 0 and tries:
+                    # Only a longer match is worth measuring
+                    if data[candidate + best_length] == data[i + best_length]:
+                        length = LZ77_MIN_MATCH
+                        while length + 32 <= max_length and data[candidate + length:candidate + length + 32] == data[i + length:i + length + 32]:
+                            length += 32
+                        while length < max_length and data[candidate + length] == data[i + length]:
+                            length += 1
+                        if length > best_length:
+                            best_length = length
+                            best_distance = i - candidate
+                            if length == max_length:
+                                break
+                    candidate = chain[candidate]
+                    tries -= 1
+            
+            if best_length >= LZ77_MIN_MATCH:
+                tokens[flag_pos] |= 1 << flag_bit
+                distance = best_distance - 1
+                tokens += bytes((best_length - LZ77_MIN_MATCH, distance & 0xFF, distance >> 8))
+                # Positions inside the match can still start later matches
+                for j in range(i + 1, min(i + best_length, size - LZ77_MIN_MATCH + 1)):
+                    key = data[j:j + LZ77_MIN_MATCH]
+                    chain[j] = head.get(key, -1)
+                    head[key] = j
+                i += best_length
+            else:
+                tokens.append(data[i])
+                i += 1
+            flag_bit += 1
+        return bytes(tokens)
+    
+    def decode(self, tokens):
+        """Rebuild the original bytes from a token stream"""
+        output = bytearray()
+        size = len(tokens)
+        i = 0
+        while i < size:
+            flags = tokens[i]
+            i += 1
+            if not flags:
+                # Eight literals in a row
+                output += tokens[i:i + 8]
+                i += 8
+                continue
+            for bit in range(8):
+                if i >= size:
+                    break
+                if flags >> bit & 1:
+                    if i + 3 > size:
+                        raise ValueError("Corrupt data: truncated LZ77 match")
+                    length = tokens[i] + LZ77_MIN_MATCH
+                    distance = (tokens[i + 1] | tokens[i + 2] << 8) + 1
+                    i += 3
+                    start = len(output) - distance
+                    if start < 0:
+                        raise ValueError("Corrupt data: LZ77 match before start of block")
+                    if distance >= length:
+                        output += output[start:start + length]
+                    else:
+                        # Overlapping match repeats the last distance bytes
+                        output += (output[start:] * (length // distance + 1))[:length]
+                else:
+                    output.append(tokens[i])
+                    i += 1
+        return bytes(output)
+
+class CodeTableCache:
+    """LRU cache of code tables keyed by a quantized histogram signature, plus shared tables by ID"""
+    def __init__(self, max_entries=DEFAULT_TABLE_CACHE_SIZE, tolerance=TABLE_CACHE_TOLERANCE):
+        self.max_entries = max_entries
+        self.tolerance = tolerance
+        self.entries = OrderedDict()
+        # Shared tables are never evicted, archives may reference them by ID
+        self.shared = {}
+        # Trained dictionary tables by lower-case file extension
+        self.by_extension = {}
+    
+    def signature(self, frequency):
+        """Quantize a histogram to roughly the code length each byte would get"""
+        total = sum(frequency.values())
+        levels = [0] * 256
+        for byte_val, freq in frequency.items():
+            levels[byte_val] = min(15, max(1, round(math.log2(total / freq))))
+        return tuple(levels)
+    
+    @staticmethod
+    def table_id(lengths):
+        """Hash a code table to the ID stored in archive headers"""
+        return hashlib.sha256(bytes(lengths.get(byte_val, 0) for byte_val in range(256))).digest()[:TABLE_ID_SIZE]
+    
+    def cost(self, lengths, frequency):
+        """Encoded size in bits of frequency with lengths, None if a byte has no code"""
+        if not all(byte_val in lengths for byte_val in frequency):
+            return None
+        return sum(freq * lengths[byte_val] for byte_val, freq in frequency.items())
+    
+    def find(self, frequency, entropy_bits, table_bits, use_shared=True):
+        """Find a close enough table as (lengths, table ID or None), or None on a miss"""
+        best = None
+        # A shared table referenced by ID also saves the table_bits an embedded table costs
+        for table_id, lengths in (self.shared.items() if use_shared else ()):
+            cost = self.cost(lengths, frequency)
+            if cost is not None and cost <= (entropy_bits + table_bits) * (1 + self.tolerance):
+                if best is None or cost < best[0]:
+                    best = (cost, lengths, table_id)
+        if best is not None:
+            return best[1], best[2]
+        
+        signature = self.signature(frequency)
+        lengths = self.entries.get(signature)
+        if lengths is not None:
+            cost = self.cost(lengths, frequency)
+            if cost is not None and cost <= entropy_bits * (1 + self.tolerance):
+                self.entries.move_to_end(signature)
+                return lengths, None
+        return None
+    
+    def store(self, frequency, lengths):
+        """Remember the table built for a histogram, evicting the least recently used"""
+        signature = self.signature(frequency)
+        self.entries[signature] = lengths
+        self.entries.move_to_end(signature)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+    
+    def add_shared(self, lengths, extension=None):
+        """Register a table archives can reference by ID and return the ID"""
+        table_id = self.table_id(lengths)
+        self.shared[table_id] = dict(lengths)
+        if extension:
+            self.by_extension[extension.lower()] = table_id
+        return table_id
+    
+    def get_shared(self, table_id):
+        """Look up a shared table by ID"""
+        lengths = self.shared.get(table_id)
+        if lengths is None:
+            raise ValueError(f"Unknown shared code table {table_id.hex()}")
+        return lengths
+
+    def save(self, path):
+        """Write the shared tables and their extensions to a dictionary file"""
+        extensions = {table_id: extension for extension, table_id in self.by_extension.items()}
+        compressor = HuffmanCompressor(engine='python')
+        with open(path, 'wb') as output:
+            output.write(DICTIONARY_MAGIC)
+            output.write(struct.pack('<BI', DICTIONARY_VERSION, len(self.shared)))
+            for table_id, lengths in self.shared.items():
+                extension = extensions.get(table_id, '').encode('utf-8')
+                table_flags, table = compressor.pack_code_lengths(lengths)
+                output.write(bytes([len(extension)]))
+                output.write(extension)
+                output.write(bytes([table_flags]))
+                output.write(table)
+    
+    @classmethod
+    def load(cls, path):
+        """Read a dictionary file written by save into a new cache"""
+        cache = cls()
+        compressor = HuffmanCompressor(engine='python')
+        with open(path, 'rb') as file:
+            if file.read(len(DICTIONARY_MAGIC)) != DICTIONARY_MAGIC:
+                raise ValueError(f"{path} is not a Huffman dictionary file")
+            version, count = struct.unpack('<BI', file.read(5))
+            if version > DICTIONARY_VERSION:
+                raise ValueError(f"Unsupported dictionary version {version}")
+            for _ in range(count):
+                extension = file.read(file.read(1)[0]).decode('utf-8')
+                table_flags = file.read(1)[0]
+                cache.add_shared(compressor.read_code_lengths(file, table_flags), extension or None)
+        return cache
+
+class CompressionStats:
+    """Wall time, bytes and allocations per stage of one compress or decompress call
+    
+    Stages nest: time spent in an inner stage is charged to it and not to the stage
+    around it, so the stage times add up to the time spent instrumented.
+    """
+    def __init__(self, trace_memory=False, profile=False):
+        # stage name -> seconds, bytes and calls, plus peak_allocated when tracing memory,
+        # which is approximate for stages that other stages nest in
+        self.stages = {}
+        self.trace_memory = trace_memory
+        self.profiler = cProfile.Profile() if profile else None
+        self.seconds = 0.0
+        self.peak_memory = None
+        self.started = None
+        self.started_tracing = False
+        # [name, seconds so far, resumed at, traced memory at start] for every open stage
+        self.active = []
+    
+    def tracing(self):
+        """Whether allocations are being traced for this call"""
+        return self.trace_memory and tracemalloc.is_tracing()
+    
+    def begin(self):
+        """Start the clock, and tracemalloc and cProfile when asked for"""
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        if self.profiler is not None:
+            self.profiler.enable()
+        self.started = time.perf_counter()
+    
+    def end(self):
+        """Stop the clock, and tracemalloc and cProfile if begin started them"""
+        self.seconds = time.perf_counter() - self.started
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self.tracing():
+            self.peak_memory = max(self.peak_memory or 0, tracemalloc.get_traced_memory()[1])
+            if self.started_tracing:
+                tracemalloc.stop()
+    
+    def start(self, name):
+        """Start timing a stage, pausing the stage it is nested in"""
+        now = time.perf_counter()
+        if self.active:
+            parent = self.active[-1]
+            parent[1] += now - parent[2]
+        memory = 0
+        if self.tracing():
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        self.active.append([name, 0.0, now, memory])
+    
+    def stop(self, nbytes=0):
+        """Stop the innermost stage and charge nbytes to it"""
+        now = time.perf_counter()
+        name, seconds, resumed, memory = self.active.pop()
+        stage = self.stages.setdefault(name, {'seconds': 0.0, 'bytes': 0, 'calls': 0})
+        stage['seconds'] += seconds + now - resumed
+        stage['bytes'] += nbytes
+        stage['calls'] += 1
+        if self.tracing():
+            # Stages reset the tracemalloc peak, so the overall peak is gathered here
+            peak = tracemalloc.get_traced_memory()[1]
+            stage['peak_allocated'] = max(stage.get('peak_allocated', 0), peak - memory)
+            self.peak_memory = max(self.peak_memory or 0, peak)
+        if self.active:
+            self.active[-1][2] = now
+    
+    @contextmanager
+    def stage(self, name, nbytes=0):
+        """Time the body of a with statement as one call of a stage"""
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop(nbytes)
+    
+    def timed(self, name, items, size=len):
+        """Yield from items, charging the time spent producing each one to a stage"""
+        items = iter(items)
+        while True:
+            self.start(name)
+            try:
+                item = next(items)
+            except StopIteration:
+                self.stop()
+                return
+            self.stop(size(item))
+            yield item
+    
+    def as_dict(self):
+        """Get the numbers as plain JSON-friendly values"""
+        stages = {}
+        for name, stage in self.stages.items():
+            stages[name] = dict(stage, seconds=round(stage['seconds'], 6))
+        result = {'seconds': round(self.seconds, 6), 'stages': stages}
+        if self.peak_memory is not None:
+            result['peak_memory'] = self.peak_memory
+        return result
+    
+    def report(self):
+        """Format one line per stage, slowest first"""
+        lines = [f"{'stage':<10}{'seconds':>10}{'share':>8}{'MB':>10}{'MB/s':>10}{'calls':>8}"]
+        for name, stage in sorted(self.stages.items(), key=lambda item: -item[1]['seconds']):
+            mb = stage['bytes'] / (1024 * 1024)
+            share = 100 * stage['seconds'] / self.seconds if self.seconds else 0
+            speed = f"{mb / stage['seconds']:10.1f}" if stage['seconds'] and stage['bytes'] else f"{'-':>10}"
+            line = f"{name:<10}{stage['seconds']:10.4f}{share:7.1f}%{mb:10.2f}{speed}{stage['calls']:8d}"
+            if 'peak_allocated' in stage:
+                line += f"  peak +{stage['peak_allocated'] / (1024 * 1024):.2f} MB"
+            lines.append(line)
+        lines.append(f"{'total':<10}{self.seconds:10.4f}")
+        if self.peak_memory is not None:
+            lines.append(f"Peak traced memory: {self.peak_memory / (1024 * 1024):.2f} MB")
+        return lines
+    
+    def profile_report(self, limit=20):
+        """Format the cProfile capture, top functions by cumulative time"""
+        if self.profiler is None:
+            return ""
+        output = io.StringIO()
+        pstats.Stats(self.profiler, stream=output).sort_stats('cumulative').print_stats(limit)
+        return output.getvalue()
+
+def instrumented(method):
+    """Give every call of a compressor method fresh stats, kept in last_stats afterwards"""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self.stats = CompressionStats(self.trace_memory, self.profile)
+        self.last_stats = self.stats
+        self.stats.begin()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.stats.end()
+    return wrapper
+
 class HuffmanCompressor:
-    def __init__(self):
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE, workers=1, adaptive=False, verbose=True,
+                 progress=None, cancel_event=None, engine='auto', table_cache=None, reference_tables=False,
+                 dictionary_max_size=DICTIONARY_MAX_FILE_SIZE, max_code_length=DEFAULT_MAX_CODE_LENGTH,
+                 lz77=False, lz77_window=DEFAULT_LZ77_WINDOW, lz77_effort=DEFAULT_LZ77_EFFORT,
+                 min_saving=DEFAULT_MIN_SAVING, trace_memory=False, profile=False):
+        if max_code_length is not None and max_code_length < 8:
+            raise ValueError("max_code_length must be at least 8 to code all 256 bytes")
+        if engine == 'auto':
+            engine = 'numpy' if np is not None else 'python'
+        if engine not in ('python', 'numpy'):
+            raise ValueError(f"Unknown engine {engine}")
+        if engine == 'numpy' and np is None:
+            raise ValueError("The numpy engine needs NumPy installed")
+        # 'numpy' counts and encodes with vectorized array operations, 'python' uses plain loops
+        self.engine = engine
         self.codes = {}
         self.reverse_mapping = {}
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.adaptive = adaptive
+        self.verbose = verbose
+        self.last_message = None
+        # progress(stage, bytes_done, bytes_total) is called after every chunk, bytes_total is None for streams
+        self.progress = progress
+        # Any object with is_set(), e.g. threading.Event, checked between chunks
+        self.cancel_event = cancel_event
+        # CodeTableCache reused across files, reference_tables stores shared tables by ID only
+        self.table_cache = table_cache
+        self.reference_tables = reference_tables
+        self.dictionary_max_size = dictionary_max_size
+        # Longest allowed code in bits, None leaves Huffman lengths unbounded
+        self.max_code_length = max_code_length
+        # LZ77 pre-pass: more CPU for much smaller output on repetitive data
+        if lz77:
+            LZ77Coder.check_settings(lz77_window, lz77_effort)
+        self.lz77 = lz77
+        self.lz77_window = lz77_window
+        self.lz77_effort = lz77_effort
+        # Fraction of the size coding must be expected to save, otherwise data is stored raw
+        self.min_saving = min_saving
+        # Per-stage numbers of the current or last call, tracemalloc and cProfile on request
+        self.trace_memory = trace_memory
+        self.profile = profile
+        self.stats = CompressionStats()
+        self.last_stats = None
+    
+    def log(self, message):
+        """Report progress, printed unless the compressor is quiet"""
+        self.last_message = message
+        if self.verbose:
+            print(message)
+    
+    def update_progress(self, stage, done, total):
+        """Report progress and stop the job if it has been cancelled"""
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise CompressionCancelled()
+        if self.progress is not None:
+            self.progress(stage, done, total)
+    
+    @contextmanager
+    def map_input(self, input_path):
+        """Map input_path read-only so chunks are views of the page cache instead of copies"""
+        with open(input_path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                # Empty files cannot be mapped
+                yield b''
+                return
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            try:
+                yield mapped
+            finally:
+                try:
+                    mapped.close()
+                except BufferError:
+                    # A cancelled job can still hold a chunk, the mapping goes away with it
+                    pass
+    
+    def read_chunks(self, mapped, start=0):
+        """Yield chunk_size memoryview slices of a mapped file from start without copying"""
+        released = start - start % mmap.PAGESIZE
+        with memoryview(mapped) as view:
+            for offset in range(start, len(view), self.chunk_size):
+                with self.stats.stage('read', min(self.chunk_size, len(view) - offset)):
+                    chunk = view[offset:offset + self.chunk_size]
+                try:
+                    yield chunk
+                finally:
+                    # Asking for the next chunk means this one has been coded
+                    chunk.release()
+                # Drop the pages already coded so resident memory stays flat
+                done = min(offset + self.chunk_size, len(view))
+                end = done - done % mmap.PAGESIZE
+                if end > released and hasattr(mmap, 'MADV_DONTNEED'):
+                    mapped.madvise(mmap.MADV_DONTNEED, released, end - released)
+                    released = end
+    
+    def map_blocks(self, func, items):
+        """Apply func to every item in order, across a process pool when workers > 1"""
+        if self.workers <= 1:
+            yield from map(func, items)
+            return
+        
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            # Keep a bounded number of blocks in flight so memory stays flat
+            pending = deque()
+            for item in items:
+                pending.append(executor.submit(func, item))
+                if len(pending) >= self.workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
     
     def build_frequency_dict(self, data):
         """Count frequency of each byte in data"""
+        if self.engine == 'numpy':
+            return _counts_to_frequency(np.bincount(np.frombuffer(data, dtype=np.uint8), minlength=256))
         return Counter(data)
     
+    def build_file_frequency_dict(self, input_path):
+        """Count frequency of each byte in a file, one chunk at a time"""
+        with self.map_input(input_path) as mapped:
+            return self.build_mapped_frequency_dict(mapped)
+    
+    def build_mapped_frequency_dict(self, mapped, chunk_frequencies=None):
+        """Count frequency of each byte in a mapped file, one chunk at a time
+        
+        When a chunk_frequencies list is given, the histogram of every chunk is added to it.
+        """
+        frequency = Counter()
+        counts = np.zeros(256, dtype=np.int64) if self.engine == 'numpy' else None
+        done = 0
+        for chunk in self.read_chunks(mapped):
+            with self.stats.stage('count', len(chunk)):
+                if counts is not None:
+                    chunk_counts = np.bincount(np.frombuffer(chunk, dtype=np.uint8), minlength=256)
+                    counts += chunk_counts
+                    if chunk_frequencies is not None:
+                        chunk_frequencies.append(_counts_to_frequency(chunk_counts))
+                elif chunk_frequencies is not None:
+                    chunk_frequencies.append(Counter(chunk))
+                    frequency.update(chunk_frequencies[-1])
+                else:
+                    frequency.update(chunk)
+            done += len(chunk)
+            self.update_progress('Counting', done, len(mapped))
+        if counts is not None:
+            return _counts_to_frequency(counts)
+        return frequency
+    
     def build_heap(self, frequency):
         """Build a min-heap based on byte frequencies"""
         heap = []
-        for byte_val, freq in frequency.items():
+        # Push in byte order so the tree does not depend on how frequencies were counted
+        for byte_val, freq in sorted(frequency.items()):
             node = HuffmanNode(byte_val, freq)
             heapq.heappush(heap, node)
         return heap
     
-    def build_huffman_tree(self, heap):
-        """Build Huffman tree by merging nodes"""
-        while len(heap) > 1:
-            node1 = heapq.heappop(heap)
-            node2 = heapq.heappop(heap)
-            
-            merged = HuffmanNode(None, node1.freq + node2.freq)
-            merged.left = node1
-            merged.right = node2
-            
-            heapq.heappush(heap, merged)
+    def build_flat_tree(self, frequency):
+        """Build the Huffman tree in flat arrays with the two-queue method
         
-        return heap[0] if heap else None
+        Returns (leaves, weights, parents). Node i < len(leaves) is the (byte, freq)
+        pair leaves[i] in ascending weight order, later nodes are merges in the order
+        they were made and the last one is the root.
+        """
+        leaves = sorted(frequency.items(), key=lambda item: (item[1], item[0]))
+        count = len(leaves)
+        weights = [freq for _, freq in leaves] + [0] * max(count - 1, 0)
+        parents = [0] * len(weights)
+        leaf = 0
+        merged = count
+        for node in range(count, len(weights)):
+            # Merges come out in ascending weight, so the smallest nodes are at the front of either queue
+            if leaf < count and (merged == node or weights[leaf] <= weights[merged]):
+                first = leaf
+                leaf += 1
+            else:
+                first = merged
+                merged += 1
+            if leaf < count and (merged == node or weights[leaf] <= weights[merged]):
+                second = leaf
+                leaf += 1
+            else:
+                second = merged
+                merged += 1
+            weights[node] = weights[first] + weights[second]
+            parents[first] = node
+            parents[second] = node
+        return leaves, weights, parents
+    
+    def build_huffman_tree(self, heap):
+        """Build Huffman tree from the leaves made by build_heap, linked as HuffmanNode views"""
+        if not heap:
+            return None
+        leaves, weights, parents = self.build_flat_tree({node.char: node.freq for node in heap})
+        leaf_nodes = {node.char: node for node in heap}
+        nodes = [leaf_nodes[byte_val] for byte_val, _ in leaves]
+        nodes += [HuffmanNode(None, weight) for weight in weights[len(leaves):]]
+        for child in range(len(nodes) - 1):
+            parent = nodes[parents[child]]
+            if parent.left is None:
+                parent.left = nodes[child]
+            else:
+                parent.right = nodes[child]
+        return nodes[-1]
     
     def build_codes(self, node, current_code=""):
         """Build Huffman codes by traversing the tree"""
-        if node is None:
-            return
-        
-        if node.char is not None:
-            # Handle single character case
-            self.codes[node.char] = current_code if current_code else "0"
-            self.reverse_mapping[current_code if current_code else "0"] = node.char
-            return
+        stack = [(node, current_code)] if node is not None else []
+        while stack:
+            node, code = stack.pop()
+            if node.char is not None:
+                # Handle single character case
+                code = code or "0"
+                self.codes[node.char] = code
+                self.reverse_mapping[code] = node.char
+                continue
+            stack.append((node.right, code + "1"))
+            stack.append((node.left, code + "0"))
+    
+    def get_code_lengths(self, root):
+        """Get the code length of every byte in the Huffman tree"""
+        lengths = {}
+        stack = [(root, 0)] if root is not None else []
+        while stack:
+            node, depth = stack.pop()
+            if node.char is not None:
+                # Handle single character case
+                lengths[node.char] = depth if depth else 1
+                continue
+            stack.append((node.left, depth + 1))
+            stack.append((node.right, depth + 1))
+        return lengths
+    
+    def limit_code_lengths(self, frequency, max_length):
+        """Get optimal code lengths no longer than max_length using package-merge"""
+        leaves = [(freq, [byte_val]) for byte_val, freq in sorted(frequency.items(), key=lambda item: (item[1], item[0]))]
+        items = leaves
+        for _ in range(max_length - 1):
+            # Pair up neighbours into packages and merge them back with the leaves
+            packages = [(items[i][0] + items[i + 1][0], items[i][1] + items[i + 1][1])
+                        for i in range(0, len(items) - 1, 2)]
+            items = list(heapq.merge(leaves, packages, key=lambda item: item[0]))
         
-        self.build_codes(node.left, current_code + "0")
-        self.build_codes(node.right, current_code + "1")
+        # Each time a byte appears in the cheapest 2n - 2 items its code gets one bit longer
+        lengths = Counter()
+        for _, byte_vals in items[:2 * len(leaves) - 2]:
+            lengths.update(byte_vals)
+        return dict(lengths)
+    
+    def build_code_lengths(self, frequency):
+        """Get Huffman code lengths for a histogram, limited to max_code_length"""
+        leaves, weights, parents = self.build_flat_tree(frequency)
+        if len(leaves) == 1:
+            lengths = {leaves[0][0]: 1}
+        else:
+            # Parents always come after their children, so one backward pass sets every depth
+            depths = [0] * len(weights)
+            for node in range(len(weights) - 2, -1, -1):
+                depths[node] = depths[parents[node]] + 1
+            lengths = {byte_val: depths[i] for i, (byte_val, _) in enumerate(leaves)}
+        if self.max_code_length is not None and lengths and max(lengths.values()) > self.max_code_length:
+            lengths = self.limit_code_lengths(frequency, self.max_code_length)
+        return lengths
+    
+    def assign_canonical_codes(self, lengths):
+        """Build canonical Huffman codes from code lengths"""
+        self.codes = {}
+        self.reverse_mapping = {}
+        code = 0
+        prev_length = 0
+        for byte_val, length in sorted(lengths.items(), key=lambda item: (item[1], item[0])):
+            code <<= length - prev_length
+            code_str = "{0:0{1}b}".format(code, length)
+            self.codes[byte_val] = code_str
+            self.reverse_mapping[code_str] = byte_val
+            code += 1
+            prev_length = length
     def get_encoded_data(self, data):
         """Convert bytes to encoded binary string"""
         encoded_text = ""
@@ -84,61 +1003,592 @@ class HuffmanCompressor:
             b.append(int(byte_segment, 2))
         return b
     
+    def pack_code_lengths(self, lengths):
+        """Pack code lengths as a 256-bit presence bitmap followed by the lengths"""
+        bitmap = bytearray(32)
+        for byte_val in lengths:
+            bitmap[byte_val >> 3] |= 0x80 >> (byte_val & 7)
+        ordered = [lengths[byte_val] for byte_val in sorted(lengths)]
+        
+        if max(ordered) <= 15:
+            # Two lengths per byte when every code fits in a nibble
+            if len(ordered) % 2:
+                ordered.append(0)
+            packed = bytes((ordered[i] << 4) | ordered[i + 1] for i in range(0, len(ordered), 2))
+            return FLAG_NIBBLE_LENGTHS, bytes(bitmap) + packed
+        return 0, bytes(bitmap) + bytes(ordered)
     
-    def compress(self, input_path, output_path):
-        """Main compression function - works with text-based file types"""
-        print(f"Compressing {input_path}...")
+    def read_code_lengths(self, file, flags):
+        """Read code lengths written by pack_code_lengths"""
+        bitmap = file.read(32)
+        symbols = [byte_val for byte_val in range(256) if bitmap[byte_val >> 3] & (0x80 >> (byte_val & 7))]
         
-        # Check if file type is supported
-        allowed_extensions = ['.txt', '.csv', '.json', '.docx', '.doc', '.xlsx', '.xls']
-        file_extension = os.path.splitext(input_path)[1].lower()
+        if flags & FLAG_NIBBLE_LENGTHS:
+            packed = file.read((len(symbols) + 1) // 2)
+            ordered = []
+            for byte in packed:
+                ordered.append(byte >> 4)
+                ordered.append(byte & 0x0F)
+        else:
+            ordered = file.read(len(symbols))
+        return dict(zip(symbols, ordered))
+    
+    def write_header(self, output, header):
+        """Write the container header at the current position"""
+        table = b''
+        if header['flags'] & FLAG_SHARED_TABLE:
+            table = header['table_id']
+        elif not header['flags'] & (FLAG_ADAPTIVE | FLAG_STORED):
+            # Adaptive archives keep their code tables in the blocks
+            table_flags, table = self.pack_code_lengths(header['lengths'])
+            header['flags'] |= table_flags
+        extension = header['extension'].encode('utf-8')
         
-        if file_extension not in allowed_extensions:
-            print(f"Error: File type {file_extension} is not supported!")
-            print(f"Supported types: {', '.join(allowed_extensions)}")
-            return False
+        self.write_header_fields(output, header)
+        output.write(bytes([len(extension)]))
+        output.write(extension)
+        output.write(table)
+    
+    def write_header_fields(self, output, header):
+        """Write the fixed-size header fields at the current position"""
+        output.write(HEADER_STRUCT.pack(
+            MAGIC, header['version'], header['flags'],
+            header['original_size'], header['crc'], header['block_count']
+        ))
+    
+    def read_header(self, file, sequential=False, end=None):
+        """Read the container header, the file must be positioned after the magic
         
-        # Read input file as binary
-        with open(input_path, 'rb') as file:
-            data = file.read()
+        Streamed archives keep their totals near the end, they are looked up unless
+        the file is read sequentially. end is where the container stops when it is
+        not the whole file, like a member of a multi-file archive.
+        """
+        fields = file.read(HEADER_STRUCT.size - len(MAGIC))
+        version, flags, original_size, crc, block_count = struct.unpack('<BBQII', fields)
+        if version > FORMAT_VERSION:
+            raise ValueError(f"Unsupported format version {version}")
+        if flags & ~KNOWN_FLAGS:
+            raise ValueError(f"Unsupported archive flags {flags:#04x}")
         
-        if not data:
-            print("File is empty!")
-            return False
+        extension_length = file.read(1)[0]
+        extension = file.read(extension_length).decode('utf-8')
+        if flags & FLAG_SHARED_TABLE:
+            if self.table_cache is None:
+                raise ValueError("Archive references a shared code table, pass a table_cache holding it")
+            lengths = self.table_cache.get_shared(file.read(TABLE_ID_SIZE))
+        elif flags & (FLAG_ADAPTIVE | FLAG_STORED):
+            lengths = {}
+        else:
+            lengths = self.read_code_lengths(file, flags)
         
+        if flags & FLAG_STREAMED and not sequential:
+            position = file.tell()
+            self.seek_trailer(file, end)
+            index_offset = TRAILER_STRUCT.unpack(file.read(TRAILER_STRUCT.size))[0]
+            file.seek(index_offset - STREAM_FOOTER_STRUCT.size)
+            original_size, crc, block_count = STREAM_FOOTER_STRUCT.unpack(file.read(STREAM_FOOTER_STRUCT.size))
+            file.seek(position)
+        return {
+            'version': version,
+            'flags': flags,
+            'original_size': original_size,
+            'crc': crc,
+            'block_count': block_count,
+            'extension': extension,
+            'lengths': lengths,
+            'end': end
+        }
+    
+    def block_struct(self, header):
+        """Get the struct of the fields before every block for the archive's version and layout"""
+        if header['flags'] & FLAG_ADAPTIVE:
+            return ADAPTIVE_BLOCK_STRUCT if header['version'] < 2 else ADAPTIVE_BLOCK_CRC_STRUCT
+        return BLOCK_STRUCT if header['version'] < 2 else BLOCK_CRC_STRUCT
+    
+    def write_block(self, output, header, block):
+        """Write one encoded block at the current position"""
+        kind, lengths, original_length, bit_count, payload, crc = block
+        block_struct = self.block_struct(header)
+        if header['flags'] & FLAG_ADAPTIVE:
+            output.write(block_struct.pack(kind, original_length, bit_count, crc))
+            if kind == BLOCK_TABLE:
+                table_flags, table = self.pack_code_lengths(lengths)
+                output.write(bytes([table_flags]))
+                output.write(table)
+        else:
+            output.write(block_struct.pack(original_length, bit_count, crc))
+        output.write(payload)
+    
+    def read_block_fields(self, file, header):
+        """Read the fields before a block as (kind, original length, bit count, CRC32 or None)"""
+        block_struct = self.block_struct(header)
+        fields = block_struct.unpack(file.read(block_struct.size))
+        if not header['flags'] & FLAG_ADAPTIVE:
+            fields = (BLOCK_SHARED,) + fields
+        if header['version'] < 2:
+            # Version 1 archives only carry the whole-file checksum
+            fields += (None,)
+        return fields
+    
+    def read_block_table(self, file):
+        """Read the code table stored after an adaptive block header"""
+        table_flags = file.read(1)[0]
+        return tuple(sorted(self.read_code_lengths(file, table_flags).items()))
+    
+    def block_info_at(self, file, header, index, position):
+        """Describe one block like iter_block_info, locating it through the block index"""
+        file.seek(index[position][0])
+        kind, original_length, bit_count, crc = self.read_block_fields(file, header)
+        if not header['flags'] & FLAG_ADAPTIVE:
+            return file.tell(), original_length, bit_count, self.header_code_lengths(header), False, crc
+        
+        code_lengths = None
+        if kind == BLOCK_TABLE:
+            code_lengths = self.read_block_table(file)
+        payload_offset = file.tell()
+        
+        if kind == BLOCK_REUSE:
+            # Walk back to the block that stored the table
+            for earlier in range(position - 1, -1, -1):
+                file.seek(index[earlier][0])
+                if file.read(1)[0] == BLOCK_TABLE:
+                    file.seek(index[earlier][0] + self.block_struct(header).size)
+                    code_lengths = self.read_block_table(file)
+                    break
+            else:
+                raise ValueError("Corrupt data: no code table for reused block")
+        lz77 = bool(header['flags'] & FLAG_LZ77) and kind != BLOCK_RAW
+        return payload_offset, original_length, bit_count, code_lengths, lz77, crc
+    
+    def header_code_lengths(self, header):
+        """Get the header's code lengths as a (byte, length) tuple, None when blocks are stored raw"""
+        if header['flags'] & FLAG_STORED:
+            return None
+        return tuple(sorted(header['lengths'].items()))
+    
+    def iter_block_info(self, file, header):
+        """Yield (payload offset, original length, bit count, code lengths, LZ77 tokens, CRC32) for every block"""
+        code_lengths = self.header_code_lengths(header)
+        for _ in range(header['block_count']):
+            block_lengths = code_lengths
+            lz77 = bool(header['flags'] & FLAG_LZ77)
+            kind, original_length, bit_count, crc = self.read_block_fields(file, header)
+            if header['flags'] & FLAG_ADAPTIVE:
+                if kind == BLOCK_TABLE:
+                    code_lengths = self.read_block_table(file)
+                    block_lengths = code_lengths
+                elif kind == BLOCK_RAW:
+                    # Raw blocks leave the table for later reuse untouched
+                    block_lengths = None
+                    lz77 = False
+            
+            yield file.tell(), original_length, bit_count, block_lengths, lz77, crc
+            file.seek((bit_count + 7) // 8, os.SEEK_CUR)
+    
+    def write_index(self, output, index, index_offset=None):
+        """Write the block index and the trailer pointing at it, by default at the current position"""
+        if index_offset is None:
+            index_offset = output.tell()
+        for entry in index:
+            output.write(INDEX_ENTRY_STRUCT.pack(*entry))
+        output.write(TRAILER_STRUCT.pack(index_offset, INDEX_MAGIC))
+    
+    def seek_trailer(self, file, end=None):
+        """Seek to the trailer of a container ending at end, by default the end of the file"""
+        if end is None:
+            file.seek(-TRAILER_STRUCT.size, os.SEEK_END)
+        else:
+            file.seek(end - TRAILER_STRUCT.size)
+    
+    def read_index(self, file, header):
+        """Read the block index as a list of (compressed offset, original offset)"""
+        self.seek_trailer(file, header.get('end'))
+        trailer_offset = file.tell()
+        index_offset, index_magic = TRAILER_STRUCT.unpack(file.read(TRAILER_STRUCT.size))
+        # The index must end right at the trailer, a leftover trailer of an interrupted append does not
+        if index_magic != INDEX_MAGIC or index_offset + INDEX_ENTRY_STRUCT.size * header['block_count'] != trailer_offset:
+            raise ValueError("Corrupt data: block index not found")
+        
+        file.seek(index_offset)
+        data = file.read(INDEX_ENTRY_STRUCT.size * header['block_count'])
+        return list(INDEX_ENTRY_STRUCT.iter_unpack(data))
+    
+    def resolve_output_path(self, output_path, original_extension):
+        """Restore the original extension on the output path"""
+        # If output path doesn't have extension, add the original one
+        output_base, output_ext = os.path.splitext(output_path)
+        if not output_ext and original_extension:
+            output_path = output_base + original_extension
+        elif output_ext and original_extension and output_ext.lower() != original_extension.lower():
+            # If user specified different extension, warn but use original
+            self.log(f"Note: Using original extension {original_extension} instead of {output_ext}")
+            output_path = output_base + original_extension
+        return output_path
+    
+    def estimate_entropy_bits(self, frequency):
+        """Estimate the smallest possible encoded size in bits from byte frequencies"""
+        total = sum(frequency.values())
+        return sum(freq * math.log2(total / freq) for _, freq in sorted(frequency.items()))
+    
+    def worth_coding(self, frequency, coded_bits=None, table_bits=0):
+        """Whether coding a histogram plus a table of table_bits promises at least min_saving
+        
+        coded_bits defaults to the entropy estimate, which no code beats.
+        """
+        if coded_bits is None:
+            coded_bits = self.estimate_entropy_bits(frequency)
+        return coded_bits + table_bits <= sum(frequency.values()) * 8 * (1 - self.min_saving)
+    
+    def header_table_bits(self, lengths, table_id):
+        """Size in bits of the code table a container header holds for lengths"""
+        if table_id is not None and self.reference_tables:
+            return 8 * TABLE_ID_SIZE
+        return 8 * len(self.pack_code_lengths(lengths)[1])
+    
+    def choose_table(self, frequency, use_shared=True):
+        """Get code lengths for a histogram as (lengths, shared table ID or None)"""
+        if self.table_cache is None:
+            return self.build_code_lengths(frequency), None
+        
+        entropy_bits = self.estimate_entropy_bits(frequency)
+        # Rough size of an embedded table: bitmap plus a nibble per byte
+        table_bits = 8 * (32 + (len(frequency) + 1) // 2)
+        cached = self.table_cache.find(frequency, entropy_bits, table_bits, use_shared and self.reference_tables)
+        # The cache may be shared with compressors built with a looser length limit
+        if cached is not None and (self.max_code_length is None or max(cached[0].values()) <= self.max_code_length):
+            return cached
+        
+        lengths = self.build_code_lengths(frequency)
+        self.table_cache.store(frequency, lengths)
+        return lengths, None
+    
+    def train_dictionary(self, sample_paths):
+        """Build a shared code table per file extension from sample files"""
+        frequencies = defaultdict(Counter)
+        for path in sample_paths:
+            extension = os.path.splitext(path)[1].lower()
+            frequencies[extension].update(self.build_file_frequency_dict(path))
+        
+        cache = CodeTableCache()
+        for extension, frequency in sorted(frequencies.items()):
+            # Every byte gets a code so any file of this type can be encoded
+            for byte_val in range(256):
+                frequency[byte_val] += 1
+            cache.add_shared(self.build_code_lengths(frequency), extension)
+        return cache
+    
+    def dictionary_table(self, input_path):
+        """Get the trained (lengths, table ID) for a small file, or None"""
+        if not self.reference_tables or self.table_cache is None:
+            return None
+        table_id = self.table_cache.by_extension.get(os.path.splitext(input_path)[1].lower())
+        if table_id is None or os.path.getsize(input_path) > self.dictionary_max_size:
+            return None
+        return self.table_cache.get_shared(table_id), table_id
+    
+    def plan_block(self, chunk, previous_lengths):
+        """Choose how to store a chunk in adaptive mode as (kind, code lengths, byte histogram)"""
+        frequency = self.build_frequency_dict(chunk)
+        raw_bits = len(chunk) * 8
+        # Huffman never beats the entropy so this bounds every coded option
+        entropy_bits = self.estimate_entropy_bits(frequency)
+        if not self.worth_coding(frequency, entropy_bits):
+            return BLOCK_RAW, None, frequency
+        
+        reuse_bits = None
+        if previous_lengths and all(byte_val in previous_lengths for byte_val in frequency):
+            reuse_bits = sum(freq * previous_lengths[byte_val] for byte_val, freq in frequency.items())
+            # Close enough to the best any new table could do, skip building one
+            if reuse_bits <= entropy_bits * (1 + ADAPTIVE_REUSE_TOLERANCE):
+                return BLOCK_REUSE, previous_lengths, frequency
+        
+        # Blocks always embed their table, so shared tables bring no saving here
+        lengths = self.choose_table(frequency, use_shared=False)[0]
+        table_bits = 8 * (1 + len(self.pack_code_lengths(lengths)[1]))
+        table_cost = sum(freq * lengths[byte_val] for byte_val, freq in frequency.items()) + table_bits
+        
+        if reuse_bits is not None and reuse_bits <= table_cost * (1 + ADAPTIVE_REUSE_TOLERANCE):
+            return BLOCK_REUSE, previous_lengths, frequency
+        if table_cost >= raw_bits:
+            return BLOCK_RAW, None, frequency
+        return BLOCK_TABLE, lengths, frequency
+    
+    def plan_blocks(self, chunks):
+        """Yield (kind, code lengths, chunk, byte histogram) for every chunk in adaptive mode"""
+        previous_lengths = None
+        for chunk in chunks:
+            with self.stats.stage('tree', len(chunk)):
+                kind, lengths, frequency = self.plan_block(chunk, previous_lengths)
+            if kind != BLOCK_RAW:
+                previous_lengths = lengths
+            yield kind, lengths, chunk, frequency
+    
+    def write_archive(self, input_path, output_path):
+        """Encode input_path into a binary container at output_path"""
+        with open(output_path, 'wb') as output:
+            self.write_container(input_path, output)
+    
+    def write_container(self, input_path, output):
+        """Encode input_path as a binary container at the current position of output, return its header"""
         # Store original file extension for decompression
         file_extension = os.path.splitext(input_path)[1]
+        header = {
+            'version': FORMAT_VERSION,
+            'extension': file_extension,
+            'flags': 0,
+            'lengths': {},
+            'original_size': 0,
+            'crc': 0,
+            'block_count': 0
+        }
+        
+        # Both passes read one mapping, bytes added to a growing file meanwhile are left out
+        with self.map_input(input_path) as mapped:
+            if self.lz77 or self.adaptive:
+                header['flags'] |= FLAG_ADAPTIVE | (FLAG_LZ77 if self.lz77 else 0)
+                encode_block, prepare = self.adaptive_block_encoder(header)
+            else:
+                # First pass: count byte frequencies without loading the whole file, and per chunk for the encoder
+                chunk_frequencies = []
+                frequency = self.build_mapped_frequency_dict(mapped, chunk_frequencies)
+                
+                with self.stats.stage('tree'):
+                    # Small files with a trained table skip tree building
+                    dictionary = self.dictionary_table(input_path)
+                    if dictionary is not None:
+                        lengths, table_id = dictionary
+                    elif self.worth_coding(frequency):
+                        # Build Huffman tree and codes, or reuse a cached table
+                        lengths, table_id = self.choose_table(frequency)
+                    else:
+                        lengths, table_id = {}, None
+                    # On small files the table can cost more than coding saves
+                    if lengths:
+                        coded_bits = sum(freq * lengths[byte_val] for byte_val, freq in frequency.items())
+                        if not self.worth_coding(frequency, coded_bits, self.header_table_bits(lengths, table_id)):
+                            lengths, table_id = {}, None
+                    header['lengths'] = lengths
+                if not header['lengths']:
+                    # Already compressed data, coding would cost CPU and grow the file
+                    self.log("Input looks incompressible, storing it without coding")
+                    header['flags'] |= FLAG_STORED
+                    encode_block = _store_block
+                    prepare = iter
+                else:
+                    if table_id is not None and self.reference_tables:
+                        header['flags'] |= FLAG_SHARED_TABLE
+                        header['table_id'] = table_id
+                    with self.stats.stage('tree'):
+                        self.assign_canonical_codes(header['lengths'])
+                    encode_block = partial(_encode_counted_block, self.codes, engine=self.engine)
+                    # The second pass reads the same chunks, so they pair up with their histograms
+                    prepare = lambda chunks: zip(chunks, chunk_frequencies)
+            
+            # Second pass: encode chunks straight to the compressed file, one block per chunk
+            start = output.tell()
+            self.write_header(output, header)
+            index = []
+            self.write_blocks(output, header, encode_block, prepare(self.coded_chunks(mapped, header)), index)
+            
+            # Sizes and checksum are only known once the whole file has been read
+            with self.stats.stage('write'):
+                # A single block is found without an index, which would cost more than small files save
+                if header['block_count'] > 1:
+                    header['flags'] |= FLAG_BLOCK_INDEX
+                    self.write_index(output, index)
+                end = output.tell()
+                output.seek(start)
+                self.write_header_fields(output, header)
+                output.seek(end)
+        return header
+    
+    def adaptive_block_encoder(self, header):
+        """Get (encode_block, prepare) for archives where every block carries its own table"""
+        if header['flags'] & FLAG_LZ77:
+            # Blocks are tokenized and coded independently, so workers need no shared state
+            encode_block = partial(_encode_lz77_block, window=self.lz77_window, effort=self.lz77_effort,
+                                   max_code_length=self.max_code_length, engine=self.engine)
+            return encode_block, iter
+        # Every block gets its own table, so a single pass is enough
+        return partial(_encode_adaptive_block, engine=self.engine), self.plan_blocks
+    
+    def coded_chunks(self, mapped, header, start=0):
+        """Yield the chunks of a mapped input from start, adding them to the header's checksum"""
+        done = 0
+        for chunk in self.read_chunks(mapped, start):
+            with self.stats.stage('checksum', len(chunk)):
+                header['crc'] = zlib.crc32(chunk, header['crc'])
+            done += len(chunk)
+            self.update_progress('Encoding', done, len(mapped) - start)
+            # Worker processes need picklable bytes, in process the view is coded in place
+            yield chunk if self.workers <= 1 else bytes(chunk)
+    
+    def write_blocks(self, output, header, encode_block, chunks, index):
+        """Encode chunks and write them as blocks at the current position, adding them to the header and index"""
+        # Blocks are written in input order so the output does not depend on workers
+        blocks = self.map_blocks(encode_block, chunks)
+        for block in self.stats.timed('encode', blocks, size=lambda block: block[2]):
+            with self.stats.stage('write', len(block[4])):
+                index.append((output.tell(), header['original_size']))
+                self.write_block(output, header, block)
+            header['original_size'] += block[2]
+            header['block_count'] += 1
+    
+    def scan_index(self, file, header):
+        """Rebuild the block index by walking the block headers, the file must be positioned at the first block"""
+        position = file.tell()
+        index = []
+        original_offset = 0
+        for payload_offset, original_length, bit_count, *_ in self.iter_block_info(file, header):
+            index.append((position, original_offset))
+            position = payload_offset + (bit_count + 7) // 8
+            original_offset += original_length
+        file.seek(position)
+        return index
+    
+    def append_container(self, input_path, output):
+        """Encode what was added to input_path since the container in output was written as new blocks
         
-        # Build Huffman tree and codes
-        frequency = self.build_frequency_dict(data)
-        heap = self.build_heap(frequency)
-        root = self.build_huffman_tree(heap)
-        self.build_codes(root)
+        New blocks go where the index was, followed by a new index. The header is
+        rewritten last, until then readers see the old block count and find the old
+        blocks by walking them, and a failure puts the old index back.
+        """
+        if output.read(len(MAGIC)) != MAGIC:
+            raise ValueError("Appending needs an archive in the binary container format")
+        header = self.read_header(output)
+        flags = header['flags']
+        if header['version'] < 2 or flags & FLAG_STREAMED or not flags & FLAG_ADAPTIVE:
+            raise ValueError("Only archives compressed with --adaptive or --lz77 can be appended to")
+        # Walk the blocks instead of trusting the trailer, an interrupted append may have left one behind
+        index = self.scan_index(output, header)
+        blocks_end = output.tell()
         
-        # Encode data
-        encoded_text = self.get_encoded_data(data)
-        padded_encoded_text = self.pad_encoded_text(encoded_text)
-        byte_array = self.get_byte_array(padded_encoded_text)
+        with self.map_input(input_path) as mapped:
+            if len(mapped) < header['original_size']:
+                raise ValueError("Input is smaller than the archived data, it was truncated or rotated")
+            if index:
+                # Checking the last archived block catches rewritten files without reading all of them
+                _, original_length, _, _, _, crc = self.block_info_at(output, header, index, len(index) - 1)
+                offset = index[-1][1]
+                if zlib.crc32(mapped[offset:offset + original_length]) != crc:
+                    raise ValueError("Input no longer matches the archived data, it was rewritten or rotated")
+            if len(mapped) == header['original_size']:
+                return header, 0
+            
+            output.seek(blocks_end)
+            old_tail = output.read()
+            # Drop the old index first, a trailer left behind would point index readers at the new blocks
+            output.truncate(blocks_end)
+            output.seek(blocks_end)
+            old_size = header['original_size']
+            encode_block, prepare = self.adaptive_block_encoder(header)
+            try:
+                chunks = self.coded_chunks(mapped, header, old_size)
+                self.write_blocks(output, header, encode_block, prepare(chunks), index)
+                with self.stats.stage('write'):
+                    header['flags'] |= FLAG_BLOCK_INDEX
+                    self.write_index(output, index)
+                    output.truncate()
+                    output.flush()
+                    os.fsync(output.fileno())
+            except BaseException:
+                output.seek(blocks_end)
+                output.write(old_tail)
+                output.truncate()
+                raise
         
-        # Write compressed file with optimized storage
-        with open(output_path, 'wb') as output:
-            # Store file metadata
-            metadata = {
-                'extension': file_extension,
-                'mapping': self.reverse_mapping
-            }
-            pickle.dump(metadata, output, protocol=pickle.HIGHEST_PROTOCOL)
-            output.write(bytes(byte_array))
+        # The header is the commit point, it fits in a single write
+        with self.stats.stage('write'):
+            output.seek(0)
+            self.write_header_fields(output, header)
+            output.flush()
+            os.fsync(output.fileno())
+        return header, header['original_size'] - old_size
+    
+    @instrumented
+    def append(self, input_path, output_path):
+        """Compress only the data added to a growing file since output_path was written
+        
+        The first run compresses the whole file, which needs adaptive or LZ77 mode so
+        that later blocks can carry their own code tables.
+        """
+        self.log(f"Appending {input_path} to {output_path}...")
+        
+        file_extension = os.path.splitext(input_path)[1].lower()
+        if file_extension not in APPEND_EXTENSIONS:
+            self.log(f"Error: File type {file_extension} is not supported!")
+            self.log(f"Supported types: {', '.join(APPEND_EXTENSIONS)}")
+            return False
+        
+        if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+            if not (self.adaptive or self.lz77):
+                self.log("Error: Append mode needs adaptive or LZ77 blocks")
+                return False
+            if os.path.getsize(input_path) == 0:
+                self.log("File is empty!")
+                return False
+            try:
+                self.write_archive(input_path, output_path)
+            except CompressionCancelled:
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+                self.log("Compression cancelled")
+                return False
+            self.log(f"Compressed {os.path.getsize(input_path)} bytes into {os.path.getsize(output_path)} bytes")
+            return True
+        
+        try:
+            with open(output_path, 'r+b') as output:
+                header, appended = self.append_container(input_path, output)
+        except CompressionCancelled:
+            self.log("Append cancelled, the compressed file is unchanged")
+            return False
+        except (ValueError, struct.error) as e:
+            self.log(f"Error: {e}")
+            return False
+        
+        if not appended:
+            self.log("Nothing new to append")
+        else:
+            self.log(f"Appended {appended} bytes as new blocks")
+        self.log(f"Compressed file now holds {header['original_size']} bytes in {header['block_count']} blocks, "
+                 f"{os.path.getsize(output_path)} bytes")
+        return True
+    
+    @instrumented
+    def compress(self, input_path, output_path):
+        """Main compression function - works with text-based file types"""
+        self.log(f"Compressing {input_path}...")
+        
+        # Check if file type is supported
+        file_extension = os.path.splitext(input_path)[1].lower()
+        
+        if file_extension not in ALLOWED_EXTENSIONS:
+            self.log(f"Error: File type {file_extension} is not supported!")
+            self.log(f"Supported types: {', '.join(ALLOWED_EXTENSIONS)}")
+            return False
+        
+        if os.path.getsize(input_path) == 0:
+            self.log("File is empty!")
+            return False
+        
+        try:
+            self.write_archive(input_path, output_path)
+        except CompressionCancelled:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            self.log("Compression cancelled")
+            return False
         
         # Calculate compression ratio
         original_size = os.path.getsize(input_path)
         compressed_size = os.path.getsize(output_path)
         ratio = (1 - compressed_size/original_size) * 100
         
-        print(f"Compression completed!")
-        print(f"Original size: {original_size} bytes")
-        print(f"Compressed size: {compressed_size} bytes")
-        print(f"Compression ratio: {ratio:.2f}%")
+        self.log(f"Compression completed!")
+        self.log(f"Original size: {original_size} bytes")
+        self.log(f"Compressed size: {compressed_size} bytes")
+        self.log(f"Compression ratio: {ratio:.2f}%")
         
         return True
     
@@ -157,7 +1607,7 @@ class HuffmanCompressor:
         
         return encoded_text
     def decode_data(self, encoded_text):
-        """Decode binary string to original bytes"""
+        """Decode binary string to original bytes (bit-by-bit reference path)"""
         current_code = ""
         decoded_data = bytearray()
         
@@ -170,57 +1620,951 @@ class HuffmanCompressor:
         
         return bytes(decoded_data)
     
-    def decode_data(self, encoded_text):
-        """Decode binary string to original bytes"""
-        current_code = ""
-        decoded_data = bytearray()
+    def decompress_blocks(self, input_path, mapped, header, output_path):
+        """Decode the blocks of a memory-mapped binary container into the output file, or only check them without one"""
+        block_info = self.iter_block_info(mapped, header)
+        crc = 0
+        size = 0
         
-        for bit in encoded_text:
-            current_code += bit
-            if current_code in self.reverse_mapping:
-                byte_val = self.reverse_mapping[current_code]
-                decoded_data.append(byte_val)
-                current_code = ""
+        with memoryview(mapped) as view, (open(output_path, 'wb') if output_path else nullcontext()) as output:
+            # Parsing block headers counts as reading, mapped pages are read in as they are decoded
+            block_info = self.stats.timed('read', block_info, size=lambda info: (info[2] + 7) // 8)
+            if self.workers > 1:
+                # Each worker reads its own blocks from the compressed file
+                blocks = self.map_blocks(partial(_decode_block_at, input_path), block_info)
+            else:
+                blocks = (_decode_block_view(view, info) for info in block_info)
+            
+            for original_length, decoded in self.stats.timed('decode', blocks, size=lambda block: len(block[1])):
+                if len(decoded) != original_length:
+                    self.log("Error: Corrupt block, decoded length does not match")
+                    return False
+                with self.stats.stage('checksum', len(decoded)):
+                    crc = zlib.crc32(decoded, crc)
+                size += len(decoded)
+                if output is not None:
+                    with self.stats.stage('write', len(decoded)):
+                        output.write(decoded)
+                self.update_progress('Decoding' if output is not None else 'Verifying', size, header['original_size'])
         
-        return bytes(decoded_data)
+        if size != header['original_size'] or crc != header['crc']:
+            self.log("Error: Checksum mismatch, the compressed file is corrupt")
+            return False
+        return True
+    
+    def decompress_legacy(self, mapped, metadata, output_path):
+        """Decode a memory-mapped archive written with the old pickled metadata header"""
+        self.reverse_mapping = metadata['mapping']
+        
+        with memoryview(mapped) as view, open(output_path, 'wb') as output:
+            # First payload byte holds the padding info
+            payload = view[mapped.tell():]
+            extra_padding = payload[0] if payload else 0
+            bit_count = max(len(payload) - 1, 0) * 8 - extra_padding
+            
+            # Decode block by block straight into the output file
+            decoder = TableDecoder(self.reverse_mapping)
+            def chunks():
+                for i in range(1, len(payload), self.chunk_size):
+                    self.update_progress('Decoding', i, len(payload))
+                    yield payload[i:i + self.chunk_size]
+            
+            for decoded in self.stats.timed('decode', decoder.iter_decode(chunks(), bit_count)):
+                with self.stats.stage('write', len(decoded)):
+                    output.write(decoded)
+            payload.release()
+        return True
     
+    def read_range(self, input_path, offset, length):
+        """Decode length bytes starting at offset of the original file, touching only the blocks needed"""
+        if offset < 0 or length < 0:
+            raise ValueError("Offset and length must not be negative")
+        
+        with open(input_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if mapped.read(len(MAGIC)) != MAGIC:
+                raise ValueError("Random access needs an archive in the binary container format")
+            try:
+                return self.read_mapped_range(mapped, offset, length)
+            except (struct.error, IndexError, OverflowError) as e:
+                # Damaged headers and indexes are reported like any other corrupt data
+                raise ValueError(f"Corrupt data: {e}") from e
+    
+    def read_mapped_range(self, mapped, offset, length):
+        """Decode a range of a mapped binary container, positioned after the magic"""
+        header = self.read_header(mapped)
+        blocks_start = mapped.tell()
+        index = None
+        if header['flags'] & FLAG_BLOCK_INDEX:
+            try:
+                index = self.read_index(mapped, header)
+            except ValueError:
+                # An interrupted append leaves the blocks readable but not the index
+                mapped.seek(blocks_start)
+        if index is None:
+            # Single-block and old archives have no index, their block headers are walked instead
+            index = self.scan_index(mapped, header)
+        starts = [original_offset for _, original_offset in index]
+        end = min(offset + length, header['original_size'])
+        if offset >= end:
+            return b""
+        
+        result = bytearray()
+        first = bisect_right(starts, offset) - 1
+        for position in range(first, len(index)):
+            if starts[position] >= end:
+                break
+            info = self.block_info_at(mapped, header, index, position)
+            # Payloads are copied so a decoding error does not keep views of the mapping alive
+            payload = mapped[info[0]:info[0] + (info[2] + 7) // 8]
+            result += _decode_block_bytes(payload, (0,) + info[1:])[1]
+        
+        start = offset - starts[first]
+        return bytes(result[start:start + end - offset])
+    
+    @instrumented
     def decompress(self, input_path, output_path):
         """Main decompression function - restores original file type"""
-        print(f"Decompressing {input_path}...")
+        self.log(f"Decompressing {input_path}...")
         
-        with open(input_path, 'rb') as file:
-            # Load metadata
-            metadata = pickle.load(file)
-            self.reverse_mapping = metadata['mapping']
-            original_extension = metadata['extension']
+        if os.path.getsize(input_path) == 0:
+            self.log("Error: Compressed file is empty!")
+            return False
+        
+        # Map the archive so payloads reach the decoder as memoryview slices, without copies
+        written = None
+        with open(input_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            try:
+                if mapped.read(len(MAGIC)) == MAGIC:
+                    header = self.read_header(mapped)
+                    output_path = self.resolve_output_path(output_path, header['extension'])
+                    decode = partial(self.decompress_blocks, input_path, mapped, header)
+                else:
+                    # Archives written before the binary container used a pickled header
+                    mapped.seek(0)
+                    metadata = pickle.load(mapped)
+                    output_path = self.resolve_output_path(output_path, metadata['extension'])
+                    decode = partial(self.decompress_legacy, mapped, metadata)
+                written = output_path
+                success = decode(output_path)
+            except CompressionCancelled:
+                self.log("Decompression cancelled")
+                success = False
+            except (ValueError, struct.error, EOFError, pickle.UnpicklingError) as e:
+                self.log(f"Error: {e}")
+                success = False
+        
+        if not success:
+            # Partial output must not be mistaken for the original file
+            if written is not None and os.path.exists(written):
+                os.remove(written)
+            return False
+        
+        self.log(f"Decompression completed!")
+        self.log(f"File saved as: {output_path}")
+        return True
+    
+    @instrumented
+    def verify(self, input_path):
+        """Decode an archive and check its block and file checksums without writing output"""
+        self.log(f"Verifying {input_path}...")
+        
+        if os.path.getsize(input_path) == 0:
+            self.log("Error: Compressed file is empty!")
+            return False
+        
+        with open(input_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if mapped.read(len(MAGIC)) != MAGIC:
+                self.log("Error: Only archives in the binary container format carry checksums")
+                return False
+            try:
+                header = self.read_header(mapped)
+                if not self.decompress_blocks(input_path, mapped, header, None):
+                    return False
+            except CompressionCancelled:
+                self.log("Verification cancelled")
+                return False
+            except (ValueError, struct.error) as e:
+                self.log(f"Error: {e}")
+                return False
+        
+        checked = "block and file checksums" if header['version'] >= 2 else "file checksum"
+        self.log(f"Archive is intact ({header['block_count']} blocks, {checked} checked)")
+        return True
+    
+    def read_directory(self, file):
+        """Read the central directory of a multi-file archive as (members by name, shared tables, offset)"""
+        file.seek(0)
+        data = file.read(ARCHIVE_HEADER_STRUCT.size)
+        if len(data) < ARCHIVE_HEADER_STRUCT.size:
+            raise ValueError("Not a multi-file archive")
+        magic, version = ARCHIVE_HEADER_STRUCT.unpack(data)
+        if magic != ARCHIVE_MAGIC:
+            raise ValueError("Not a multi-file archive")
+        if version > ARCHIVE_VERSION:
+            raise ValueError(f"Unsupported archive version {version}")
+        
+        self.seek_trailer(file)
+        directory_offset, directory_magic = TRAILER_STRUCT.unpack(file.read(TRAILER_STRUCT.size))
+        if directory_magic != DIRECTORY_MAGIC:
+            raise ValueError("Corrupt data: archive directory not found")
+        try:
+            file.seek(directory_offset)
+            member_count, table_count = DIRECTORY_STRUCT.unpack(file.read(DIRECTORY_STRUCT.size))
+            tables = {}
+            for _ in range(table_count):
+                lengths = self.read_code_lengths(file, file.read(1)[0])
+                tables[CodeTableCache.table_id(lengths)] = lengths
+            members = {}
+            for _ in range(member_count):
+                offset, length, original_size, crc, name_length = MEMBER_STRUCT.unpack(file.read(MEMBER_STRUCT.size))
+                name = file.read(name_length).decode('utf-8')
+                members[name] = {'name': name, 'offset': offset, 'length': length,
+                                 'original_size': original_size, 'crc': crc}
+        except (struct.error, IndexError, OverflowError) as e:
+            # Callers such as the GUI only expect ValueError for damaged archives
+            raise ValueError(f"Corrupt data: archive directory is damaged ({e})") from e
+        return members, tables, directory_offset
+    
+    def write_directory(self, output, members, tables):
+        """Write the central directory and the trailer pointing at it"""
+        directory_offset = output.tell()
+        output.write(DIRECTORY_STRUCT.pack(len(members), len(tables)))
+        for lengths in tables.values():
+            table_flags, table = self.pack_code_lengths(lengths)
+            output.write(bytes([table_flags]))
+            output.write(table)
+        for member in members.values():
+            name = member['name'].encode('utf-8')
+            output.write(MEMBER_STRUCT.pack(member['offset'], member['length'], member['original_size'],
+                                            member['crc'], len(name)))
+            output.write(name)
+        output.write(TRAILER_STRUCT.pack(directory_offset, DIRECTORY_MAGIC))
+    
+    def list_archive(self, archive_path):
+        """List the members of a multi-file archive, reading only its central directory"""
+        with open(archive_path, 'rb') as file:
+            members = self.read_directory(file)[0]
+        return list(members.values())
+    
+    @instrumented
+    def add_to_archive(self, archive_path, input_paths, names=None, share_tables=False):
+        """Compress files into a multi-file archive, creating it if needed
+        
+        Members are stored under their file names unless names are given, a member
+        with the same name replaces the older one. With share_tables, a code table
+        built for one member may be referenced by ID from later ones and is stored
+        once in the directory.
+        """
+        names = names or [os.path.basename(input_path) for input_path in input_paths]
+        for input_path in input_paths:
+            file_extension = os.path.splitext(input_path)[1].lower()
+            if file_extension not in ALLOWED_EXTENSIONS:
+                self.log(f"Error: File type {file_extension} is not supported!")
+                self.log(f"Supported types: {', '.join(ALLOWED_EXTENSIONS)}")
+                return False
+            if not os.path.isfile(input_path):
+                self.log(f"Error: {input_path} is not a file")
+                return False
+        
+        # Sharing is scoped to this call, files compressed later must not reference tables only the archive holds
+        saved = (self.table_cache, self.reference_tables)
+        shared = dict(self.table_cache.shared) if self.table_cache is not None else None
+        if share_tables:
+            if self.table_cache is None:
+                self.table_cache = CodeTableCache()
+            self.reference_tables = True
+        try:
+            return self.update_archive(archive_path, input_paths, names, share_tables)
+        finally:
+            self.table_cache, self.reference_tables = saved
+            if shared is not None:
+                self.table_cache.shared = shared
+    
+    def update_archive(self, archive_path, input_paths, names, share_tables):
+        """Write new members and a new directory after the old one, which stays valid until the end"""
+        exists = os.path.exists(archive_path) and os.path.getsize(archive_path) > 0
+        try:
+            with open(archive_path, 'r+b' if exists else 'w+b') as output:
+                if exists:
+                    try:
+                        members, tables, _ = self.read_directory(output)
+                    except (ValueError, struct.error) as e:
+                        self.log(f"Error: {e}")
+                        return False
+                    self.load_archive_tables(tables)
+                    output.seek(0, os.SEEK_END)
+                else:
+                    members, tables = {}, {}
+                    output.write(ARCHIVE_HEADER_STRUCT.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION))
+                original_length = output.tell()
+                try:
+                    self.write_members(output, input_paths, names, members, tables, share_tables)
+                except BaseException:
+                    # Drop partly written members so the old directory ends the file again
+                    output.truncate(original_length)
+                    raise
+        except BaseException as e:
+            if not exists and os.path.exists(archive_path):
+                os.remove(archive_path)
+            if isinstance(e, CompressionCancelled):
+                self.log("Adding to archive cancelled")
+                return False
+            raise
+        
+        self.log(f"Archive {archive_path} holds {len(members)} files, {os.path.getsize(archive_path)} bytes")
+        return True
+    
+    def write_members(self, output, input_paths, names, members, tables, share_tables):
+        """Write input files as archive members at the current position, followed by the directory"""
+        for input_path, name in zip(input_paths, names):
+            self.log(f"Adding {input_path} as {name}...")
+            offset = output.tell()
+            header = self.write_container(input_path, output)
+            members.pop(name, None)
+            members[name] = {'name': name, 'offset': offset, 'length': output.tell() - offset,
+                             'original_size': header['original_size'], 'crc': header['crc']}
+            if header['flags'] & FLAG_SHARED_TABLE:
+                tables[header['table_id']] = self.table_cache.get_shared(header['table_id'])
+            elif share_tables and header['lengths'] and not header['flags'] & FLAG_ADAPTIVE:
+                # Later members with a similar histogram can reference this table
+                self.table_cache.add_shared(header['lengths'])
+        self.write_directory(output, members, tables)
+    
+    def load_archive_tables(self, tables):
+        """Make the shared tables stored in an archive directory available to its members"""
+        if not tables:
+            return
+        if self.table_cache is None:
+            self.table_cache = CodeTableCache()
+        for lengths in tables.values():
+            self.table_cache.add_shared(lengths)
+    
+    @instrumented
+    def extract_from_archive(self, archive_path, output_dir, names=None):
+        """Extract the named members, or all of them, of a multi-file archive into output_dir"""
+        self.log(f"Extracting from {archive_path}...")
+        with open(archive_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            try:
+                members, tables, _ = self.read_directory(mapped)
+            except (ValueError, struct.error) as e:
+                self.log(f"Error: {e}")
+                return False
+            self.load_archive_tables(tables)
             
-            # Read compressed data
-            bit_string = ""
-            byte = file.read(1)
-            while byte:
-                byte_val = byte[0]  # ✅ Correct way to get integer value of byte
-                bits = bin(byte_val)[2:].rjust(8, '0')
-                bit_string += bits
-                byte = file.read(1)
-
+            for name in names or list(members):
+                member = members.get(name)
+                if member is None:
+                    self.log(f"Error: {name} is not in the archive")
+                    return False
+                output_path = os.path.normpath(os.path.join(output_dir, name))
+                # Names come from the archive, never write outside output_dir or over it
+                if (os.path.commonpath([os.path.abspath(output_dir), os.path.abspath(output_path)]) != os.path.abspath(output_dir)
+                        or os.path.abspath(output_path) == os.path.abspath(output_dir)):
+                    self.log(f"Error: Unsafe member name {name}")
+                    return False
+                os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+                
+                try:
+                    mapped.seek(member['offset'])
+                    if mapped.read(len(MAGIC)) != MAGIC:
+                        raise ValueError(f"Corrupt data: member {name} not found")
+                    header = self.read_header(mapped, end=member['offset'] + member['length'])
+                    if not self.decompress_blocks(archive_path, mapped, header, output_path):
+                        return False
+                except CompressionCancelled:
+                    if os.path.exists(output_path):
+                        os.remove(output_path)
+                    self.log("Extraction cancelled")
+                    return False
+                except (ValueError, struct.error) as e:
+                    if os.path.exists(output_path):
+                        os.remove(output_path)
+                    self.log(f"Error: {e}")
+                    return False
+                self.log(f"Extracted {name}")
+        return True
+    
+    async def compress_async(self, input_path, output_path, executor=None):
+        """Run compress on an executor, by default the event loop's thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, self.compress, input_path, output_path)
+    
+    async def decompress_async(self, input_path, output_path, executor=None):
+        """Run decompress on an executor, by default the event loop's thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, self.decompress, input_path, output_path)
+    
+    async def read_stream_chunk(self, reader):
+        """Read chunk_size bytes from an asyncio stream, fewer only at its end"""
+        parts = []
+        size = 0
+        while size < self.chunk_size:
+            part = await reader.read(self.chunk_size - size)
+            if not part:
+                break
+            parts.append(part)
+            size += len(part)
+        return b''.join(parts)
+    
+    async def read_stream_table(self, reader, flags):
+        """Read the bytes of a code table written by pack_code_lengths from an asyncio stream"""
+        bitmap = await reader.readexactly(32)
+        count = sum(bin(byte).count('1') for byte in bitmap)
+        return bitmap + await reader.readexactly((count + 1) // 2 if flags & FLAG_NIBBLE_LENGTHS else count)
+    
+    async def compress_stream(self, reader, writer, extension='', executor=None):
+        """Compress an asyncio StreamReader-like source into a StreamWriter-like sink
         
-        # Decode data
-        encoded_text = self.remove_padding(bit_string)
-        decompressed_data = self.decode_data(encoded_text)
+        Blocks are coded on the executor while the next chunk is read and the previous
+        block is written, so the body is never buffered whole.
+        """
+        loop = asyncio.get_running_loop()
+        header = {
+            'version': FORMAT_VERSION,
+            'extension': extension,
+            'flags': FLAG_BLOCK_INDEX | FLAG_ADAPTIVE | FLAG_STREAMED,
+            'lengths': {},
+            'original_size': 0,
+            'crc': 0,
+            'block_count': 0
+        }
+        if self.lz77:
+            header['flags'] |= FLAG_LZ77
+            encode_block = partial(_encode_lz77_block, window=self.lz77_window, effort=self.lz77_effort,
+                                   max_code_length=self.max_code_length, engine=self.engine)
+        else:
+            encode_block = partial(_encode_planned_block, engine=self.engine, max_code_length=self.max_code_length)
         
-        # If output path doesn't have extension, add the original one
-        output_base, output_ext = os.path.splitext(output_path)
-        if not output_ext and original_extension:
-            output_path = output_base + original_extension
-        elif output_ext and original_extension and output_ext.lower() != original_extension.lower():
-            # If user specified different extension, warn but use original
-            print(f"Note: Using original extension {original_extension} instead of {output_ext}")
-            output_path = output_base + original_extension
+        def submit(chunk, previous_lengths):
+            if self.lz77:
+                return loop.run_in_executor(executor, encode_block, chunk)
+            return loop.run_in_executor(executor, encode_block, chunk, previous_lengths)
         
-        # Write decompressed file as binary
-        with open(output_path, 'wb') as output:
-            output.write(decompressed_data)
+        buffer = io.BytesIO()
+        self.write_header(buffer, header)
+        offset = buffer.tell()
+        writer.write(buffer.getvalue())
+        
+        index = []
+        previous_lengths = None
+        try:
+            chunk = await self.read_stream_chunk(reader)
+            pending = submit(chunk, None) if chunk else None
+            while pending is not None:
+                next_chunk = await self.read_stream_chunk(reader)
+                block = await pending
+                if block[0] != BLOCK_RAW:
+                    previous_lengths = block[1]
+                pending = submit(next_chunk, previous_lengths) if next_chunk else None
+                
+                buffer = io.BytesIO()
+                self.write_block(buffer, header, block)
+                writer.write(buffer.getvalue())
+                await writer.drain()
+                index.append((offset, header['original_size']))
+                offset += buffer.tell()
+                header['original_size'] += block[2]
+                header['crc'] = zlib.crc32(chunk, header['crc'])
+                header['block_count'] += 1
+                chunk = next_chunk
+                self.update_progress('Encoding', header['original_size'], None)
+        except CompressionCancelled:
+            self.log("Compression cancelled")
+            return False
+        
+        buffer = io.BytesIO()
+        self.write_block(buffer, header, (BLOCK_END, None, 0, 0, b'', 0))
+        buffer.write(STREAM_FOOTER_STRUCT.pack(header['original_size'], header['crc'], header['block_count']))
+        self.write_index(buffer, index, offset + buffer.tell())
+        writer.write(buffer.getvalue())
+        await writer.drain()
+        return True
+    
+    async def decompress_stream(self, reader, writer, executor=None):
+        """Decompress an archive from an asyncio StreamReader-like source into a StreamWriter-like sink"""
+        loop = asyncio.get_running_loop()
+        try:
+            fields = await reader.readexactly(HEADER_STRUCT.size)
+            if fields[:len(MAGIC)] != MAGIC:
+                self.log("Error: Streams need an archive in the binary container format")
+                return False
+            flags = fields[5]
+            extension = await reader.readexactly((await reader.readexactly(1))[0])
+            table = b''
+            if flags & FLAG_SHARED_TABLE:
+                table = await reader.readexactly(TABLE_ID_SIZE)
+            elif not flags & (FLAG_ADAPTIVE | FLAG_STORED):
+                table = await self.read_stream_table(reader, flags)
+            header = self.read_header(io.BytesIO(fields[len(MAGIC):] + bytes([len(extension)]) + extension + table),
+                                     sequential=True)
+            
+            code_lengths = self.header_code_lengths(header)
+            block_struct = self.block_struct(header)
+            crc = 0
+            size = 0
+            count = 0
+            pending = None
+            while True:
+                block = None
+                if header['flags'] & FLAG_STREAMED or count < header['block_count']:
+                    data = await reader.readexactly(block_struct.size)
+                    kind, original_length, bit_count, block_crc = self.read_block_fields(io.BytesIO(data), header)
+                    if kind != BLOCK_END:
+                        block_lengths = code_lengths
+                        if kind == BLOCK_TABLE:
+                            table_flags = await reader.readexactly(1)
+                            table = await self.read_stream_table(reader, table_flags[0])
+                            code_lengths = self.read_block_table(io.BytesIO(table_flags + table))
+                            block_lengths = code_lengths
+                        elif kind == BLOCK_RAW:
+                            block_lengths = None
+                        lz77 = bool(header['flags'] & FLAG_LZ77) and kind != BLOCK_RAW
+                        payload = await reader.readexactly((bit_count + 7) // 8)
+                        info = (0, original_length, bit_count, block_lengths, lz77, block_crc)
+                        block = loop.run_in_executor(executor, _decode_block_bytes, payload, info)
+                        count += 1
+                
+                # Write the previous block while the current one decodes
+                if pending is not None:
+                    original_length, decoded = await pending
+                    if len(decoded) != original_length:
+                        self.log("Error: Corrupt block, decoded length does not match")
+                        return False
+                    crc = zlib.crc32(decoded, crc)
+                    size += len(decoded)
+                    writer.write(decoded)
+                    await writer.drain()
+                    self.update_progress('Decoding', size, header['original_size'] or None)
+                if block is None:
+                    break
+                pending = block
+            
+            if header['flags'] & FLAG_STREAMED:
+                footer = await reader.readexactly(STREAM_FOOTER_STRUCT.size)
+                header['original_size'], header['crc'], header['block_count'] = STREAM_FOOTER_STRUCT.unpack(footer)
+        except CompressionCancelled:
+            self.log("Decompression cancelled")
+            return False
+        except asyncio.IncompleteReadError:
+            self.log("Error: Archive stream ended early")
+            return False
+        except (ValueError, struct.error) as e:
+            self.log(f"Error: {e}")
+            return False
         
-        print(f"Decompression completed!")
-        print(f"File saved as: {output_path}")
+        if size != header['original_size'] or crc != header['crc'] or count != header['block_count']:
+            self.log("Error: Checksum mismatch, the compressed stream is corrupt")
+            return False
         return True
+
+
+@lru_cache(maxsize=32)
+def _get_decoder(code_lengths):
+    """Build a table decoder for a tuple of (byte, code length) pairs, cached per process"""
+    compressor = HuffmanCompressor()
+    compressor.assign_canonical_codes(dict(code_lengths))
+    return TableDecoder(compressor.reverse_mapping)
+
+def _counts_to_frequency(counts):
+    """Convert a 256-entry count array to a frequency Counter without zero entries"""
+    return Counter({byte_val: int(count) for byte_val, count in enumerate(counts) if count})
+
+def _numpy_pack(codes, chunk):
+    """Encode chunk with vectorized gathers, returning the same bytes as BitWriter"""
+    values = np.zeros(256, dtype=np.uint64)
+    lengths = np.zeros(256, dtype=np.int64)
+    for byte_val, code in codes.items():
+        values[byte_val] = int(code, 2)
+        lengths[byte_val] = len(code)
+    
+    symbols = np.frombuffer(chunk, dtype=np.uint8)
+    packed = bytearray()
+    leftover = np.zeros(0, dtype=np.uint8)
+    bit_count = 0
+    
+    for start in range(0, len(symbols), NUMPY_PACK_SYMBOLS):
+        part = symbols[start:start + NUMPY_PACK_SYMBOLS]
+        part_lengths = lengths[part]
+        if not part_lengths.all():
+            raise ValueError("Data contains a byte that has no code in the table")
+        part_values = values[part]
+        ends = np.cumsum(part_lengths)
+        part_bits = int(ends[-1])
+        
+        # Spread every code over its bits: owner is the symbol each output bit belongs to
+        owner = np.repeat(np.arange(len(part)), part_lengths)
+        position = np.arange(part_bits) - (ends - part_lengths)[owner]
+        shift = (part_lengths[owner] - 1 - position).astype(np.uint64)
+        bits = ((part_values[owner] >> shift) & np.uint64(1)).astype(np.uint8)
+        
+        # Carry bits that do not fill a whole byte over to the next step
+        bits = np.concatenate((leftover, bits))
+        whole = len(bits) - len(bits) % 8
+        packed += np.packbits(bits[:whole]).tobytes()
+        leftover = bits[whole:]
+        bit_count += part_bits
+    
+    if len(leftover):
+        packed += np.packbits(leftover).tobytes()
+    return bit_count, bytes(packed)
+
+def _encode_block(codes, chunk, engine='python', frequency=None):
+    """Encode one chunk with the shared table as (kind, lengths, original length, bit count, payload)
+    
+    frequency is the chunk's byte histogram, counted here unless the caller already has it.
+    """
+    if engine == 'numpy' and max(len(code) for code in codes.values()) <= NUMPY_MAX_CODE_LENGTH:
+        bit_count, payload = _numpy_pack(codes, chunk)
+        return BLOCK_SHARED, None, len(chunk), bit_count, payload, zlib.crc32(chunk)
+    
+    if frequency is None:
+        frequency = Counter(chunk)
+    # A byte without a code would silently be written as zero bits
+    if not all(byte_val in codes for byte_val in frequency):
+        raise ValueError("Data contains a byte that has no code in the table")
+    # The exact size lets the writer allocate the payload once, at its final length
+    bit_count = sum(freq * len(codes[byte_val]) for byte_val, freq in frequency.items())
+    writer = BitWriter(codes)
+    encoded = writer.encode(chunk, bit_count)
+    encoded += writer.flush()
+    return BLOCK_SHARED, None, len(chunk), bit_count, encoded, zlib.crc32(chunk)
+
+def _encode_counted_block(codes, counted, engine='python'):
+    """Encode one (chunk, byte histogram) pair with the shared table"""
+    chunk, frequency = counted
+    return _encode_block(codes, chunk, engine, frequency)
+
+def _store_block(chunk):
+    """Keep one chunk uncoded as (kind, lengths, original length, bit count, payload, CRC32)"""
+    return BLOCK_RAW, None, len(chunk), len(chunk) * 8, bytes(chunk), zlib.crc32(chunk)
+
+def _encode_adaptive_block(planned, engine='python'):
+    """Encode one chunk planned by HuffmanCompressor.plan_block"""
+    kind, lengths, chunk, frequency = planned
+    if kind == BLOCK_RAW:
+        return _store_block(chunk)
+    
+    compressor = HuffmanCompressor()
+    compressor.assign_canonical_codes(lengths)
+    return (kind, lengths) + _encode_block(compressor.codes, chunk, engine, frequency)[2:]
+
+def _encode_lz77_block(chunk, window=DEFAULT_LZ77_WINDOW, effort=DEFAULT_LZ77_EFFORT,
+                       max_code_length=DEFAULT_MAX_CODE_LENGTH, engine='python'):
+    """Tokenize one chunk with LZ77 and Huffman-code the tokens with their own table"""
+    tokens = LZ77Coder(window, effort).encode(chunk)
+    compressor = HuffmanCompressor(verbose=False, engine=engine, max_code_length=max_code_length)
+    kind, lengths, frequency = compressor.plan_block(tokens, None)
+    if kind != BLOCK_RAW:
+        block = _encode_adaptive_block((kind, lengths, tokens, frequency), engine)
+        table_size = 1 + len(compressor.pack_code_lengths(lengths)[1])
+        if len(block[4]) + table_size < len(chunk):
+            return kind, lengths, len(chunk), block[3], block[4], zlib.crc32(chunk)
+    # Matches did not pay off, keep the chunk as it is
+    return _store_block(chunk)
+
+def _encode_planned_block(chunk, previous_lengths, engine='python', max_code_length=DEFAULT_MAX_CODE_LENGTH):
+    """Plan and encode one adaptive block, for streams that cannot plan ahead of the coder"""
+    compressor = HuffmanCompressor(verbose=False, engine=engine, max_code_length=max_code_length)
+    kind, lengths, frequency = compressor.plan_block(chunk, previous_lengths)
+    return _encode_adaptive_block((kind, lengths, chunk, frequency), engine)
+
+def _decode_block_view(view, info):
+    """Decode one block described by HuffmanCompressor.iter_block_info from a memoryview"""
+    payload_offset, original_length, bit_count, code_lengths, lz77, crc = info
+    with view[payload_offset:payload_offset + (bit_count + 7) // 8] as payload:
+        if code_lengths is None:
+            decoded = bytes(payload)
+        else:
+            decoded = _get_decoder(code_lengths).decode(payload, bit_count)
+    if lz77:
+        decoded = LZ77Coder().decode(decoded)
+    # Checked here so worker processes verify their own blocks
+    if crc is not None and zlib.crc32(decoded) != crc:
+        raise ValueError("Corrupt data: block checksum mismatch")
+    return original_length, decoded
+
+def _decode_block_bytes(payload, info):
+    """Decode one block whose payload was read into bytes, info offsets are relative to it"""
+    with memoryview(payload) as view:
+        return _decode_block_view(view, info)
+
+def _decode_block_at(input_path, info):
+    """Read one block described by iter_block_info from the compressed file and decode it"""
+    payload_offset, _, bit_count = info[:3]
+    with open(input_path, 'rb') as file:
+        file.seek(payload_offset)
+        payload = file.read((bit_count + 7) // 8)
+    # A copy instead of a mapping, errors in the decoder then leave nothing exported behind
+    return _decode_block_bytes(payload, (0,) + info[1:])
+
+@lru_cache(maxsize=None)
+def _process_table_cache(dictionary=None):
+    """One CodeTableCache per batch worker process, seeded from a dictionary file"""
+    return CodeTableCache.load(dictionary) if dictionary else CodeTableCache()
+
+def _compress_file_job(input_path, output_path, options):
+    """Compress one file for the batch command and return its stats"""
+    options = dict(options)
+    dictionary = options.pop('dictionary', None)
+    if options.pop('cache_tables', False) or dictionary:
+        options['table_cache'] = _process_table_cache(dictionary)
+        options['reference_tables'] = dictionary is not None
+    compressor = HuffmanCompressor(verbose=False, **options)
+    start = time.perf_counter()
+    try:
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        success = compressor.compress(input_path, output_path)
+        error = None if success else compressor.last_message
+    except Exception as e:
+        success = False
+        error = str(e)
+    
+    stats = {
+        'input': input_path,
+        'output': output_path,
+        'status': 'compressed' if success else 'failed',
+        'original_size': os.path.getsize(input_path),
+        'compressed_size': os.path.getsize(output_path) if success else None,
+        'seconds': round(time.perf_counter() - start, 6),
+        'stages': compressor.last_stats.as_dict()['stages'] if compressor.last_stats else {}
+    }
+    if error:
+        stats['error'] = error
+    return stats
+
+def find_batch_jobs(source_dir, output_dir):
+    """Walk source_dir for supported files and pair each with its output path"""
+    jobs = []
+    for dir_path, dir_names, file_names in os.walk(source_dir):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            if os.path.splitext(file_name)[1].lower() not in ALLOWED_EXTENSIONS:
+                continue
+            input_path = os.path.join(dir_path, file_name)
+            relative_path = os.path.relpath(input_path, source_dir)
+            jobs.append((input_path, os.path.join(output_dir, relative_path + '.huf')))
+    return jobs
+
+def is_up_to_date(input_path, output_path):
+    """Check whether output_path was written after input_path last changed"""
+    return os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(input_path)
+
+def compress_directory(source_dir, output_dir, workers=None, force=False, options=None, report=print):
+    """Compress every supported file under source_dir, reporting one JSON line per file"""
+    options = options or {}
+    jobs = find_batch_jobs(source_dir, output_dir)
+    summary = {'files': 0, 'skipped': 0, 'failed': 0, 'original_bytes': 0, 'compressed_bytes': 0,
+               'stage_seconds': {}}
+    start = time.perf_counter()
+    
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for input_path, output_path in jobs:
+            if not force and is_up_to_date(input_path, output_path):
+                summary['skipped'] += 1
+                report(json.dumps({'input': input_path, 'output': output_path, 'status': 'skipped'}))
+                continue
+            futures.append(executor.submit(_compress_file_job, input_path, output_path, options))
+        
+        for future in as_completed(futures):
+            stats = future.result()
+            if stats['status'] == 'compressed':
+                summary['files'] += 1
+                summary['original_bytes'] += stats['original_size']
+                summary['compressed_bytes'] += stats['compressed_size']
+                for name, stage in stats['stages'].items():
+                    summary['stage_seconds'][name] = round(summary['stage_seconds'].get(name, 0) + stage['seconds'], 6)
+            else:
+                summary['failed'] += 1
+            report(json.dumps(stats))
+    
+    seconds = time.perf_counter() - start
+    summary['seconds'] = round(seconds, 6)
+    summary['files_per_second'] = round(summary['files'] / seconds, 3) if seconds else None
+    summary['bytes_per_second'] = round(summary['original_bytes'] / seconds, 3) if seconds else None
+    report(json.dumps({'summary': summary}))
+    return summary
+
+def print_stats(compressor, args):
+    """Print the stage table and cProfile capture of the last call when asked for"""
+    if compressor.last_stats is None:
+        return
+    if args.stats or args.trace_memory:
+        print("\n".join(compressor.last_stats.report()), file=sys.stderr)
+    if args.profile:
+        print(compressor.last_stats.profile_report(), file=sys.stderr)
+
+def main(argv=None):
+    """Command line entry point: python -m huffman compress|decompress|batch|add|list|extract"""
+    parser = argparse.ArgumentParser(prog='python -m huffman', description="Huffman file compressor")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    compress_parser = subparsers.add_parser('compress', help="compress one file")
+    compress_parser.add_argument('input')
+    compress_parser.add_argument('output')
+    compress_parser.add_argument('--append', action='store_true',
+                                 help="only compress data added since the output was written, for growing logs")
+    
+    decompress_parser = subparsers.add_parser('decompress', help="decompress one file")
+    decompress_parser.add_argument('input')
+    decompress_parser.add_argument('output')
+    
+    verify_parser = subparsers.add_parser('verify', help="check archives without writing output")
+    verify_parser.add_argument('inputs', nargs='+')
+    verify_parser.add_argument('--quiet', action='store_true', help="only report damaged archives")
+    
+    train_parser = subparsers.add_parser('train', help="build a dictionary of code tables from sample files")
+    train_parser.add_argument('dictionary', help="dictionary file to write")
+    train_parser.add_argument('samples', nargs='+', help="sample files or directories")
+    
+    batch_parser = subparsers.add_parser('batch', help="compress every supported file in a directory tree")
+    batch_parser.add_argument('source_dir')
+    batch_parser.add_argument('output_dir')
+    batch_parser.add_argument('--jobs', type=int, default=os.cpu_count(), help="files compressed at once")
+    batch_parser.add_argument('--force', action='store_true', help="recompress files that are up to date")
+    batch_parser.add_argument('--cache-tables', action='store_true',
+                              help="reuse code tables between files with similar byte statistics")
+    
+    add_parser = subparsers.add_parser('add', help="add files or directories to a multi-file archive")
+    add_parser.add_argument('archive')
+    add_parser.add_argument('inputs', nargs='+')
+    add_parser.add_argument('--share-tables', action='store_true',
+                            help="store code tables once and reference them from similar members")
+    
+    list_parser = subparsers.add_parser('list', help="list the members of a multi-file archive")
+    list_parser.add_argument('archive')
+    
+    extract_parser = subparsers.add_parser('extract', help="extract members of a multi-file archive")
+    extract_parser.add_argument('archive')
+    extract_parser.add_argument('output_dir')
+    extract_parser.add_argument('names', nargs='*', help="members to extract, all when omitted")
+    
+    for sub in (compress_parser, decompress_parser, batch_parser, add_parser, extract_parser):
+        sub.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="bytes per block")
+        sub.add_argument('--quiet', action='store_true', help="only report errors")
+    for sub in (compress_parser, decompress_parser, verify_parser, add_parser, extract_parser):
+        sub.add_argument('--workers', type=int, default=1, help="processes used for the blocks of one file")
+        sub.add_argument('--stats', action='store_true', help="print time, bytes and calls per stage")
+        sub.add_argument('--trace-memory', action='store_true', help="add tracemalloc peaks to --stats")
+        sub.add_argument('--profile', action='store_true', help="print the top functions from cProfile")
+    for sub in (compress_parser, decompress_parser, batch_parser, verify_parser, add_parser):
+        sub.add_argument('--dictionary', help="trained dictionary file, used for small files")
+    for sub in (compress_parser, batch_parser, add_parser):
+        sub.add_argument('--adaptive', action='store_true', help="build a code table per block")
+    for sub in (compress_parser, batch_parser, add_parser):
+        sub.add_argument('--lz77', action='store_true', help="find repeated strings before Huffman coding")
+        sub.add_argument('--lz77-window', type=int, default=DEFAULT_LZ77_WINDOW,
+                         help=f"how far back matches may reach, at most {LZ77_MAX_WINDOW} bytes")
+        sub.add_argument('--lz77-effort', type=int, default=DEFAULT_LZ77_EFFORT,
+                         help="candidate matches tried per position, higher is smaller but slower")
+    for sub in (compress_parser, batch_parser, add_parser):
+        sub.add_argument('--min-saving', type=float, default=DEFAULT_MIN_SAVING,
+                         help="store data raw when coding is expected to save less than this fraction")
+    for sub in (compress_parser, batch_parser, train_parser, add_parser):
+        sub.add_argument('--max-code-length', type=int, default=DEFAULT_MAX_CODE_LENGTH,
+                         help="longest code in bits, e.g. 12 or 15 (0 for unbounded)")
+    
+    args = parser.parse_args(argv)
+    max_code_length = getattr(args, 'max_code_length', DEFAULT_MAX_CODE_LENGTH) or None
+    if max_code_length is not None and max_code_length < 8:
+        parser.error("--max-code-length must be at least 8")
+    
+    if args.command == 'train':
+        samples = []
+        for sample in args.samples:
+            if os.path.isdir(sample):
+                samples.extend(input_path for input_path, _ in find_batch_jobs(sample, sample))
+            else:
+                samples.append(sample)
+        cache = HuffmanCompressor(verbose=False, max_code_length=max_code_length).train_dictionary(samples)
+        cache.save(args.dictionary)
+        for extension, table_id in sorted(cache.by_extension.items()):
+            print(f"{extension}: table {table_id.hex()}")
+        return 0
+    
+    if args.command == 'verify':
+        compressor = HuffmanCompressor(workers=args.workers, verbose=not args.quiet,
+                                       trace_memory=args.trace_memory, profile=args.profile)
+        if args.dictionary:
+            compressor.table_cache = CodeTableCache.load(args.dictionary)
+        damaged = 0
+        for input_path in args.inputs:
+            if not compressor.verify(input_path):
+                damaged += 1
+                if args.quiet:
+                    print(f"{input_path}: {compressor.last_message}", file=sys.stderr)
+            print_stats(compressor, args)
+        return 1 if damaged else 0
+    
+    if args.command == 'batch':
+        summary = compress_directory(
+            args.source_dir, args.output_dir, workers=args.jobs, force=args.force,
+            options={'chunk_size': args.chunk_size, 'adaptive': args.adaptive,
+                     'max_code_length': max_code_length, 'min_saving': args.min_saving, 'lz77': args.lz77,
+                     'lz77_window': args.lz77_window, 'lz77_effort': args.lz77_effort,
+                     'cache_tables': args.cache_tables, 'dictionary': args.dictionary}
+        )
+        if not args.quiet:
+            print(f"{summary['files']} files, {summary['original_bytes']:,} bytes in {summary['seconds']:.2f}s: "
+                  f"{summary['files_per_second']} files/s, "
+                  f"{(summary['bytes_per_second'] or 0) / (1024 * 1024):.2f} MB/s", file=sys.stderr)
+        return 1 if summary['failed'] else 0
+    
+    if args.command == 'list':
+        try:
+            members = HuffmanCompressor(verbose=False).list_archive(args.archive)
+        except (OSError, ValueError, struct.error) as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 1
+        for member in members:
+            print(f"{member['original_size']:>14,} {member['length']:>14,}  {member['name']}")
+        return 0
+    
+    options = {}
+    if args.command in ('compress', 'add'):
+        # Appended blocks carry their own code tables
+        adaptive = args.adaptive or (getattr(args, 'append', False) and not args.lz77)
+        options = {'adaptive': adaptive, 'min_saving': args.min_saving, 'lz77': args.lz77,
+                   'lz77_window': args.lz77_window, 'lz77_effort': args.lz77_effort}
+    compressor = HuffmanCompressor(chunk_size=args.chunk_size, workers=args.workers, verbose=not args.quiet,
+                                   max_code_length=max_code_length, trace_memory=args.trace_memory,
+                                   profile=args.profile, **options)
+    if getattr(args, 'dictionary', None):
+        compressor.table_cache = CodeTableCache.load(args.dictionary)
+        compressor.reference_tables = True
+    if args.command == 'compress' and args.append:
+        success = compressor.append(args.input, args.output)
+    elif args.command == 'compress':
+        success = compressor.compress(args.input, args.output)
+    elif args.command == 'add':
+        input_paths, names = [], []
+        for input_path in args.inputs:
+            if os.path.isdir(input_path):
+                # Keep the directory name so members from different trees don't collide
+                parent = os.path.dirname(os.path.abspath(input_path))
+                for path, _ in find_batch_jobs(input_path, input_path):
+                    input_paths.append(path)
+                    names.append(os.path.relpath(os.path.abspath(path), parent).replace(os.sep, '/'))
+            else:
+                input_paths.append(input_path)
+                names.append(os.path.basename(input_path))
+        try:
+            success = compressor.add_to_archive(args.archive, input_paths, names, share_tables=args.share_tables)
+        except OSError as e:
+            compressor.log(f"Error: {e}")
+            success = False
+    elif args.command == 'extract':
+        try:
+            success = compressor.extract_from_archive(args.archive, args.output_dir, args.names)
+        except OSError as e:
+            compressor.log(f"Error: {e}")
+            success = False
+    else:
+        success = compressor.decompress(args.input, args.output)
+    if not success and args.quiet:
+        print(compressor.last_message, file=sys.stderr)
+    print_stats(compressor, args)
+    return 0 if success else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
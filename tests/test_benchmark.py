@@ -0,0 +1,40 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+from huffman import ALLOWED_EXTENSIONS
+
+
+class CorpusTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def test_parse_size(self):
+        self.assertEqual(benchmark.parse_size("512"), 512)
+        self.assertEqual(benchmark.parse_size("64k"), 64 << 10)
+        self.assertEqual(benchmark.parse_size("1.5M"), 3 << 19)
+
+    def test_corpus_file_sizes(self):
+        for extension in ALLOWED_EXTENSIONS:
+            for size in (4096, 65536):
+                with self.subTest(extension=extension, size=size):
+                    path = os.path.join(self.tmp, 'corpus' + extension)
+                    benchmark.make_corpus_file(path, extension, size)
+                    if extension in ('.docx', '.xlsx'):
+                        # Zip members are sized from a compression estimate
+                        self.assertLess(abs(os.path.getsize(path) - size), 300)
+                        with zipfile.ZipFile(path) as archive:
+                            self.assertIsNone(archive.testzip())
+                    else:
+                        self.assertEqual(os.path.getsize(path), size)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,784 @@
+import asyncio
+import heapq
+import json
+import os
+import pickle
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+import zlib
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import huffman
+from huffman import (BitWriter, CodeTableCache, HuffmanCompressor, LZ77Coder, TableDecoder, FLAG_BLOCK_INDEX,
+                     FLAG_SHARED_TABLE, FLAG_STORED, FORMAT_VERSION, HEADER_STRUCT, INDEX_ENTRY_STRUCT, MAGIC,
+                     TRAILER_STRUCT)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def make_text(size, seed=0):
+    """Repetitive CSV-like text with a skewed byte histogram"""
+    rng = random.Random(seed)
+    words = ["alpha", "beta", "gamma", "delta", "epsilon", "zeta", "eta", "theta"]
+    lines = []
+    total = 0
+    while total < size:
+        line = f"{rng.randint(1, 99999)},{rng.choice(words)},{rng.random():.4f}\n"
+        lines.append(line)
+        total += len(line)
+    return "".join(lines).encode()[:size]
+
+
+class StreamSink:
+    """Minimal StreamWriter stand-in collecting written bytes"""
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+
+class HuffmanTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def path(self, name):
+        return os.path.join(self.tmp, name)
+
+    def write_file(self, name, data):
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(data)
+        return path
+
+    def read_file(self, path):
+        with open(path, 'rb') as file:
+            return file.read()
+
+    def round_trip(self, data, name='input.txt', **options):
+        """Compress and decompress data, returning the compressed path"""
+        source = self.write_file(name, data)
+        compressed = self.path(name + '.huf')
+        self.assertTrue(HuffmanCompressor(verbose=False, **options).compress(source, compressed))
+        restored = self.path('restored' + os.path.splitext(name)[1])
+        decompressor = HuffmanCompressor(verbose=False, workers=options.get('workers', 1))
+        self.assertTrue(decompressor.decompress(compressed, restored), decompressor.last_message)
+        self.assertEqual(self.read_file(restored), data)
+        return compressed
+
+    def corrupt(self, data, position, **options):
+        """Compress data and flip a bit at position of the output, the middle if negative"""
+        source = self.write_file('input.txt', data)
+        compressed = self.path('input.huf')
+        self.assertTrue(HuffmanCompressor(verbose=False, **options).compress(source, compressed))
+        archive = bytearray(self.read_file(compressed))
+        archive[position if position >= 0 else len(archive) // 2] ^= 0x10
+        return self.write_file('bad.huf', bytes(archive))
+
+    def header_flags(self, path):
+        with open(path, 'rb') as file:
+            return HEADER_STRUCT.unpack(file.read(HEADER_STRUCT.size))[2]
+
+    def decompress_stream(self, compressed):
+        """Decode compressed bytes through decompress_stream and return the output"""
+        async def decode():
+            reader = asyncio.StreamReader()
+            reader.feed_data(compressed)
+            reader.feed_eof()
+            restored = StreamSink()
+            self.assertTrue(await HuffmanCompressor(verbose=False).decompress_stream(reader, restored))
+            return bytes(restored.data)
+
+        return asyncio.run(decode())
+
+
+class DecoderTests(HuffmanTestCase):
+    def test_table_decoder_matches_reference_decoder(self):
+        data = make_text(20000, seed=1)
+        compressor = HuffmanCompressor(verbose=False)
+        compressor.assign_canonical_codes(compressor.build_code_lengths(Counter(data)))
+        encoded_text = compressor.get_encoded_data(data)
+        payload = bytes(compressor.get_byte_array(compressor.pad_encoded_text(encoded_text))[1:])
+
+        self.assertEqual(compressor.decode_data(encoded_text), data)
+        for table_bits in (4, 8, 12):
+            decoder = TableDecoder(compressor.reverse_mapping, table_bits)
+            self.assertEqual(decoder.decode(payload, len(encoded_text)), data)
+
+    def test_codes_longer_than_table(self):
+        # Fibonacci frequencies give codes far longer than one table lookup
+        frequency = {}
+        a, b = 1, 1
+        for byte_val in range(30):
+            frequency[byte_val] = a
+            a, b = b, a + b
+        compressor = HuffmanCompressor(verbose=False, max_code_length=None)
+        compressor.assign_canonical_codes(compressor.build_code_lengths(frequency))
+        data = bytes(range(30)) * 3
+        encoded_text = compressor.get_encoded_data(data)
+        payload = bytes(compressor.get_byte_array(compressor.pad_encoded_text(encoded_text))[1:])
+        self.assertGreater(max(len(code) for code in compressor.codes.values()), 8)
+        self.assertEqual(TableDecoder(compressor.reverse_mapping, 8).decode(payload, len(encoded_text)), data)
+
+
+
+class BitWriterTests(HuffmanTestCase):
+    def test_matches_string_encoder(self):
+        data = make_text(30000, seed=2)
+        compressor = HuffmanCompressor(verbose=False)
+        compressor.assign_canonical_codes(compressor.build_code_lengths(Counter(data)))
+        expected = compressor.get_byte_array(compressor.pad_encoded_text(compressor.get_encoded_data(data)))[1:]
+
+        # Leftover bits carry over between calls, so any split gives the same bytes
+        for step in (1, 7, 1000, len(data)):
+            writer = BitWriter(compressor.codes)
+            packed = bytearray()
+            for start in range(0, len(data), step):
+                packed += writer.encode(data[start:start + step])
+            packed += writer.flush()
+            self.assertEqual(packed, expected)
+
+    def test_block_has_exact_size(self):
+        data = make_text(30000, seed=2)
+        compressor = HuffmanCompressor(verbose=False)
+        compressor.assign_canonical_codes(compressor.build_code_lengths(Counter(data)))
+        encoded_text = compressor.get_encoded_data(data)
+        block = huffman._encode_block(compressor.codes, data, engine='python')
+        self.assertEqual(block[3], len(encoded_text))
+        self.assertEqual(block[4], compressor.get_byte_array(compressor.pad_encoded_text(encoded_text))[1:])
+
+
+
+class StreamingTests(HuffmanTestCase):
+    def test_chunk_sizes(self):
+        data = make_text(100000, seed=3)
+        for chunk_size in (1, 4096, 1 << 14, 1 << 20):
+            with self.subTest(chunk_size=chunk_size):
+                self.round_trip(data[:5000] if chunk_size == 1 else data, chunk_size=chunk_size)
+
+    def test_single_byte_file(self):
+        self.round_trip(b'a' * 1000, name='single.csv', chunk_size=256)
+
+    def test_file_growing_during_compress(self):
+        source = self.write_file('grow.txt', b'abc\n' * 100000)
+        grown = []
+
+        def progress(stage, done, total):
+            if stage == 'Encoding' and not grown:
+                with open(source, 'ab') as file:
+                    file.write(b'XYZ!' * 1000)
+                grown.append(True)
+
+        compressor = HuffmanCompressor(verbose=False, progress=progress, chunk_size=1 << 14)
+        self.assertTrue(compressor.compress(source, self.path('grow.huf')))
+        self.assertTrue(HuffmanCompressor(verbose=False).decompress(self.path('grow.huf'), self.path('out.txt')))
+        self.assertEqual(self.read_file(self.path('out.txt')), b'abc\n' * 100000)
+
+    def test_encoder_rejects_byte_without_code(self):
+        compressor = HuffmanCompressor(verbose=False)
+        compressor.assign_canonical_codes({ord('a'): 1, ord('b'): 1})
+        with self.assertRaises(ValueError):
+            huffman._encode_block(compressor.codes, b'abc')
+
+
+
+class ContainerTests(HuffmanTestCase):
+    def test_header_fields(self):
+        data = make_text(50000, seed=4)
+        compressed = self.round_trip(data, name='data.csv')
+        with open(compressed, 'rb') as file:
+            magic, version, _, original_size, crc, block_count = HEADER_STRUCT.unpack(file.read(HEADER_STRUCT.size))
+            file.seek(len(MAGIC))
+            header = HuffmanCompressor(verbose=False).read_header(file)
+        self.assertEqual((magic, version, original_size, crc), (MAGIC, FORMAT_VERSION, len(data), zlib.crc32(data)))
+        self.assertEqual(block_count, 1)
+        self.assertEqual(header['extension'], '.csv')
+
+    def test_legacy_pickle_archive(self):
+        # Written the way compress did before the binary container
+        data = make_text(20000, seed=5)
+        compressor = HuffmanCompressor(verbose=False)
+        compressor.assign_canonical_codes(compressor.build_code_lengths(Counter(data)))
+        byte_array = compressor.get_byte_array(compressor.pad_encoded_text(compressor.get_encoded_data(data)))
+        legacy = self.path('legacy.huf')
+        with open(legacy, 'wb') as output:
+            pickle.dump({'extension': '.csv', 'mapping': compressor.reverse_mapping}, output,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+            output.write(bytes(byte_array))
+
+        self.assertTrue(HuffmanCompressor(verbose=False, chunk_size=4096).decompress(legacy, self.path('out')))
+        self.assertEqual(self.read_file(self.path('out.csv')), data)
+
+
+
+class ParallelTests(HuffmanTestCase):
+    def test_output_does_not_depend_on_workers(self):
+        data = make_text(300000, seed=6)
+        outputs = []
+        for workers in (1, 2, 3):
+            with self.subTest(workers=workers):
+                compressed = self.round_trip(data, chunk_size=1 << 14, workers=workers)
+                outputs.append(self.read_file(compressed))
+        self.assertEqual(outputs[1], outputs[0])
+        self.assertEqual(outputs[2], outputs[0])
+
+
+
+class AdaptiveTests(HuffmanTestCase):
+    def test_heterogeneous_file(self):
+        rng = random.Random(7)
+        data = make_text(100000, seed=7) + bytes(rng.randrange(256) for _ in range(50000)) + b'0123456789' * 10000
+        static = self.round_trip(data, name='static.txt', chunk_size=1 << 14)
+        adaptive = self.round_trip(data, name='adaptive.txt', chunk_size=1 << 14, adaptive=True)
+        # Every block gets a table fitted to its own bytes
+        self.assertLess(os.path.getsize(adaptive), os.path.getsize(static))
+
+
+
+class RandomAccessTests(HuffmanTestCase):
+    def test_read_range(self):
+        data = make_text(200000, seed=8)
+        for options in ({'chunk_size': 1 << 14}, {'chunk_size': 1 << 14, 'adaptive': True}, {}):
+            with self.subTest(**{key: str(value) for key, value in options.items()}):
+                compressed = self.round_trip(data, **options)
+                compressor = HuffmanCompressor(verbose=False)
+                for offset, length in ((0, 10), (16380, 10), (150000, 60000), (199990, 100), (300000, 5)):
+                    self.assertEqual(compressor.read_range(compressed, offset, length), data[offset:offset + length])
+
+    def test_damaged_archive_raises_value_error(self):
+        data = make_text(60000, seed=9)
+        for options in ({'chunk_size': 1 << 14}, {'chunk_size': 1 << 14, 'adaptive': True}, {}):
+            with self.subTest(**{key: str(value) for key, value in options.items()}):
+                archive = self.read_file(self.round_trip(data, **options))
+                damaged = [archive[:size] for size in (6, 20, 40, len(archive) // 2, len(archive) - 1)]
+                # Header fields and the trailer
+                for position in list(range(4, HEADER_STRUCT.size + 1)) + list(range(len(archive) - 12, len(archive))):
+                    flipped = bytearray(archive)
+                    flipped[position] ^= 0x80
+                    damaged.append(bytes(flipped))
+                for archive_data in damaged:
+                    bad = self.write_file('bad.huf', archive_data)
+                    try:
+                        HuffmanCompressor(verbose=False).read_range(bad, 1000, 20000)
+                    except ValueError:
+                        pass
+
+    def test_negative_range(self):
+        compressed = self.round_trip(make_text(1000))
+        with self.assertRaises(ValueError):
+            HuffmanCompressor(verbose=False).read_range(compressed, -1, 10)
+
+
+
+class MappedDecompressTests(HuffmanTestCase):
+    def test_invalid_code(self):
+        # A single-symbol table turns any flipped bit into an invalid code
+        bad = self.corrupt(b'a' * 200000, -1)
+        for workers in (1, 2):
+            with self.subTest(workers=workers):
+                output = self.path('out.txt')
+                compressor = HuffmanCompressor(verbose=False, workers=workers)
+                self.assertFalse(compressor.decompress(bad, output))
+                self.assertIn("invalid Huffman code", compressor.last_message)
+                self.assertFalse(os.path.exists(output))
+        with self.assertRaises(ValueError):
+            HuffmanCompressor(verbose=False).read_range(bad, 0, 100)
+
+
+
+class BatchTests(HuffmanTestCase):
+    def test_compress_directory(self):
+        files = {'a.csv': make_text(5000, seed=1), 'sub/b.json': make_text(8000, seed=2), 'skip.bin': b'xyz'}
+        for name, data in files.items():
+            self.write_file('src/' + name, data)
+        lines = []
+        summary = huffman.compress_directory(self.path('src'), self.path('out'), workers=2, report=lines.append)
+        self.assertEqual((summary['files'], summary['failed']), (2, 0))
+        self.assertEqual(json.loads(lines[-1])['summary']['files'], 2)
+        for name in ('a.csv', 'sub/b.json'):
+            restored = self.path(os.path.basename(name))
+            self.assertTrue(HuffmanCompressor(verbose=False).decompress(self.path(f'out/{name}.huf'), restored))
+            self.assertEqual(self.read_file(restored), files[name])
+
+        # Outputs newer than their inputs are left alone
+        summary = huffman.compress_directory(self.path('src'), self.path('out'), workers=2, report=lines.append)
+        self.assertEqual((summary['files'], summary['skipped']), (0, 2))
+
+
+
+class CancelTests(HuffmanTestCase):
+    def test_cancel_removes_output(self):
+        source = self.write_file('input.txt', make_text(100000, seed=9))
+        compressed = self.path('input.huf')
+        cancel_event = threading.Event()
+
+        def progress(stage, done, total):
+            cancel_event.set()
+
+        compressor = HuffmanCompressor(verbose=False, chunk_size=1 << 14, progress=progress, cancel_event=cancel_event)
+        self.assertFalse(compressor.compress(source, compressed))
+        self.assertEqual(compressor.last_message, "Compression cancelled")
+        self.assertFalse(os.path.exists(compressed))
+
+        self.assertTrue(HuffmanCompressor(verbose=False, chunk_size=1 << 14).compress(source, compressed))
+        compressor = HuffmanCompressor(verbose=False, chunk_size=1 << 14, progress=progress, cancel_event=cancel_event)
+        self.assertFalse(compressor.decompress(compressed, self.path('out.txt')))
+        self.assertFalse(os.path.exists(self.path('out.txt')))
+
+
+
+@unittest.skipIf(numpy is None, "NumPy is not installed")
+class NumpyEngineTests(HuffmanTestCase):
+    def test_engines_agree(self):
+        data = make_text(200000, seed=10) + bytes(range(256))
+        python = HuffmanCompressor(verbose=False, engine='python')
+        vectorized = HuffmanCompressor(verbose=False, engine='numpy')
+        self.assertEqual(vectorized.build_frequency_dict(data), python.build_frequency_dict(data))
+
+        outputs = []
+        for engine in ('python', 'numpy'):
+            for options in ({'chunk_size': 1 << 14}, {'chunk_size': 1 << 14, 'adaptive': True}):
+                with self.subTest(engine=engine, adaptive=options.get('adaptive', False)):
+                    outputs.append(self.read_file(self.round_trip(data, engine=engine, **options)))
+        # Both engines write byte-identical archives
+        self.assertEqual(outputs[2:], outputs[:2])
+
+    def test_encoder_rejects_byte_without_code(self):
+        compressor = HuffmanCompressor(verbose=False)
+        compressor.assign_canonical_codes({ord('a'): 1, ord('b'): 1})
+        with self.assertRaises(ValueError):
+            huffman._encode_block(compressor.codes, b'abc', engine='numpy')
+
+
+
+class TableCacheTests(HuffmanTestCase):
+    def test_similar_files_reuse_table(self):
+        cache = CodeTableCache()
+        compressor = HuffmanCompressor(verbose=False, table_cache=cache)
+        first = Counter(make_text(50000, seed=11))
+        lengths, table_id = compressor.choose_table(first)
+        self.assertIsNone(table_id)
+        self.assertEqual(len(cache.entries), 1)
+
+        # A histogram from the same source maps to the same signature and gets the stored table
+        self.assertIs(compressor.choose_table(Counter(make_text(50000, seed=12)))[0], lengths)
+        self.assertEqual(len(cache.entries), 1)
+        self.assertIsNot(compressor.choose_table(Counter(b'0123456789' * 1000))[0], lengths)
+        self.assertEqual(len(cache.entries), 2)
+
+    def test_round_trip_with_cache(self):
+        cache = CodeTableCache()
+        for seed in range(3):
+            self.round_trip(make_text(20000, seed=seed), name=f'f{seed}.csv', table_cache=cache)
+
+
+
+class DictionaryTests(HuffmanTestCase):
+    def test_trained_dictionary(self):
+        samples = [self.write_file(f'samples/s{i}.json', make_text(2000, seed=i)) for i in range(5)]
+        dictionary = self.path('tables.hufd')
+        HuffmanCompressor(verbose=False).train_dictionary(samples).save(dictionary)
+
+        source = self.write_file('small.json', make_text(3000, seed=9))
+        compressed = self.path('small.huf')
+        compressor = HuffmanCompressor(verbose=False, table_cache=CodeTableCache.load(dictionary),
+                                       reference_tables=True)
+        self.assertTrue(compressor.compress(source, compressed))
+        self.assertTrue(self.header_flags(compressed) & FLAG_SHARED_TABLE)
+        self.assertFalse(HuffmanCompressor(verbose=False).decompress(compressed, self.path('out.json')))
+        decompressor = HuffmanCompressor(verbose=False, table_cache=CodeTableCache.load(dictionary))
+        self.assertTrue(decompressor.decompress(compressed, self.path('out.json')))
+        self.assertEqual(self.read_file(self.path('out.json')), self.read_file(source))
+
+    def test_single_block_has_no_index(self):
+        compressed = self.round_trip(make_text(5000), name='data.json')
+        self.assertFalse(self.header_flags(compressed) & FLAG_BLOCK_INDEX)
+        compressed = self.round_trip(make_text(50000), name='data.json', chunk_size=1 << 14)
+        self.assertTrue(self.header_flags(compressed) & FLAG_BLOCK_INDEX)
+
+
+
+class LengthLimitTests(HuffmanTestCase):
+    def test_code_lengths_respect_limit(self):
+        # Fibonacci frequencies give the deepest possible unlimited tree
+        frequency = {}
+        a, b = 1, 1
+        for byte_val in range(40):
+            frequency[byte_val] = a
+            a, b = b, a + b
+
+        unlimited = HuffmanCompressor(verbose=False, max_code_length=None).build_code_lengths(frequency)
+        self.assertGreater(max(unlimited.values()), 15)
+        for limit in (8, 12, 15):
+            lengths = HuffmanCompressor(verbose=False, max_code_length=limit).build_code_lengths(frequency)
+            self.assertEqual(set(lengths), set(frequency))
+            self.assertLessEqual(max(lengths.values()), limit)
+            # Kraft inequality holds with equality for a complete prefix code
+            self.assertEqual(sum(2 ** (limit - length) for length in lengths.values()), 2 ** limit)
+
+    def test_round_trip_with_limit(self):
+        rng = random.Random(13)
+        data = bytes(min(int(rng.expovariate(0.3)), 255) for _ in range(100000))
+        for limit in (9, 15, None):
+            with self.subTest(max_code_length=limit):
+                self.round_trip(data, chunk_size=1 << 14, max_code_length=limit)
+
+    def test_limit_too_small(self):
+        with self.assertRaises(ValueError):
+            HuffmanCompressor(verbose=False, max_code_length=7)
+
+
+
+class LZ77Tests(HuffmanTestCase):
+    def test_coder_round_trip(self):
+        coder = LZ77Coder(window=4096, effort=8)
+        for data in (b'', b'ab', b'abcabcabcabcabcabc', make_text(50000, seed=14), os.urandom(5000)):
+            self.assertEqual(coder.decode(coder.encode(data)), data)
+
+    def test_repetitive_data(self):
+        data = make_text(2000, seed=15) * 50
+        plain = self.round_trip(data, name='plain.txt', chunk_size=1 << 14)
+        matched = self.round_trip(data, name='matched.txt', chunk_size=1 << 14, lz77=True)
+        self.assertLess(os.path.getsize(matched), os.path.getsize(plain) // 4)
+
+    def test_invalid_settings(self):
+        for options in ({'lz77_window': 0}, {'lz77_effort': 0}):
+            with self.subTest(**options), self.assertRaises(ValueError):
+                HuffmanCompressor(verbose=False, lz77=True, **options)
+
+
+
+class IntegrityTests(HuffmanTestCase):
+    def assert_rejected(self, bad, workers=1):
+        output = self.path('out.txt')
+        compressor = HuffmanCompressor(verbose=False, workers=workers)
+        self.assertFalse(compressor.decompress(bad, output))
+        self.assertFalse(os.path.exists(output))
+        self.assertFalse(HuffmanCompressor(verbose=False, workers=workers).verify(bad))
+
+    def test_verify_intact_archive(self):
+        compressed = self.round_trip(make_text(100000, seed=16), chunk_size=1 << 14)
+        self.assertTrue(HuffmanCompressor(verbose=False).verify(compressed))
+
+    def test_payload_bit_flip(self):
+        for options in ({'chunk_size': 1 << 14}, {'chunk_size': 1 << 14, 'adaptive': True},
+                        {'chunk_size': 1 << 14, 'lz77': True}):
+            with self.subTest(**{key: str(value) for key, value in options.items()}):
+                self.assert_rejected(self.corrupt(make_text(100000, seed=17), -1, **options))
+
+    def test_bad_headers(self):
+        source = self.write_file('input.txt', make_text(10000))
+        compressed = self.path('input.huf')
+        HuffmanCompressor(verbose=False).compress(source, compressed)
+        archive = self.read_file(compressed)
+        for name, data in (('truncated', archive[:10]), ('version', MAGIC + b'\x09' + archive[5:]),
+                           ('flags', archive[:5] + b'\x80' + archive[6:]), ('garbage', b'not an archive')):
+            with self.subTest(name):
+                self.assert_rejected(self.write_file(name + '.huf', data))
+
+    def test_bad_header_keeps_existing_output(self):
+        existing = self.write_file('out.txt', b'keep me')
+        bad = self.write_file('bad.huf', MAGIC + b'\x09' + bytes(30))
+        self.assertFalse(HuffmanCompressor(verbose=False).decompress(bad, existing))
+        self.assertEqual(self.read_file(existing), b'keep me')
+
+
+
+class AsyncTests(HuffmanTestCase):
+    def test_stream_round_trip(self):
+        data = make_text(100000, seed=18)
+
+        async def compress():
+            reader = asyncio.StreamReader()
+            reader.feed_data(data)
+            reader.feed_eof()
+            compressed = StreamSink()
+            self.assertTrue(await HuffmanCompressor(verbose=False, chunk_size=1 << 14).compress_stream(
+                reader, compressed, extension='.csv'))
+            return bytes(compressed.data)
+
+        compressed = asyncio.run(compress())
+        self.assertEqual(self.decompress_stream(compressed), data)
+        # Streamed archives are also readable from a file
+        restored = self.path('out.csv')
+        self.assertTrue(HuffmanCompressor(verbose=False).decompress(self.write_file('s.huf', compressed), restored))
+        self.assertEqual(self.read_file(restored), data)
+
+    def test_file_archive_through_stream(self):
+        data = make_text(100000, seed=19)
+        compressed = self.round_trip(data, chunk_size=1 << 14)
+        self.assertEqual(self.decompress_stream(self.read_file(compressed)), data)
+
+    def test_async_file_api(self):
+        data = make_text(20000, seed=20)
+        source = self.write_file('input.txt', data)
+        compressor = HuffmanCompressor(verbose=False)
+
+        async def round_trip():
+            self.assertTrue(await compressor.compress_async(source, self.path('input.huf')))
+            self.assertTrue(await compressor.decompress_async(self.path('input.huf'), self.path('out.txt')))
+
+        asyncio.run(round_trip())
+        self.assertEqual(self.read_file(self.path('out.txt')), data)
+
+
+
+class FlatTreeTests(HuffmanTestCase):
+    def test_lengths_are_optimal(self):
+        rng = random.Random(21)
+        for symbols in (2, 3, 17, 256):
+            frequency = {byte_val: rng.randint(1, 1000) for byte_val in rng.sample(range(256), symbols)}
+            compressor = HuffmanCompressor(verbose=False, max_code_length=None)
+            lengths = compressor.build_code_lengths(frequency)
+
+            # The optimal encoded size is the sum of every merged weight
+            heap = list(frequency.values())
+            heapq.heapify(heap)
+            optimal = 0
+            while len(heap) > 1:
+                merged = heapq.heappop(heap) + heapq.heappop(heap)
+                optimal += merged
+                heapq.heappush(heap, merged)
+            self.assertEqual(sum(freq * lengths[byte_val] for byte_val, freq in frequency.items()), optimal)
+
+            # The node view over the flat arrays gives the same lengths
+            root = compressor.build_huffman_tree(compressor.build_heap(frequency))
+            self.assertEqual(compressor.get_code_lengths(root), lengths)
+
+    def test_single_symbol(self):
+        self.assertEqual(HuffmanCompressor(verbose=False).build_code_lengths({65: 10}), {65: 1})
+
+
+
+class StoreRawTests(HuffmanTestCase):
+    def test_incompressible_input_is_stored(self):
+        data = os.urandom(100000)
+        for options in ({'chunk_size': 1 << 14}, {'chunk_size': 1 << 14, 'adaptive': True}):
+            with self.subTest(adaptive=options.get('adaptive', False)):
+                compressed = self.round_trip(data, name='random.txt', **options)
+                # Only block headers and the index are added
+                self.assertLess(os.path.getsize(compressed), len(data) * 1.01)
+        self.assertTrue(self.header_flags(self.round_trip(data, name='random.txt')) & FLAG_STORED)
+
+    def test_tiny_file_stays_small(self):
+        data = b'{"id": 1, "ok": true}\n'
+        compressed = self.round_trip(data, name='tiny.json')
+        # The code table would cost more than coding saves
+        self.assertTrue(self.header_flags(compressed) & FLAG_STORED)
+        self.assertLess(os.path.getsize(compressed), len(data) + 80)
+
+    def test_stored_archive_through_stream(self):
+        data = os.urandom(50000)
+        compressed = self.round_trip(data, name='random.txt')
+        self.assertEqual(self.decompress_stream(self.read_file(compressed)), data)
+
+
+
+class StatsTests(HuffmanTestCase):
+    def test_stages(self):
+        data = make_text(100000, seed=22)
+        source = self.write_file('input.txt', data)
+        compressor = HuffmanCompressor(verbose=False, chunk_size=1 << 14, trace_memory=True)
+        self.assertTrue(compressor.compress(source, self.path('input.huf')))
+        stats = compressor.last_stats.as_dict()
+        for name in ('read', 'count', 'tree', 'encode', 'checksum', 'write'):
+            self.assertIn(name, stats['stages'])
+        self.assertEqual(stats['stages']['count']['bytes'], len(data))
+        self.assertIn('peak_allocated', stats['stages']['encode'])
+        self.assertGreater(stats['peak_memory'], 0)
+        # Nested stages are charged once, so their times add up to the whole call
+        self.assertLessEqual(sum(stage['seconds'] for stage in stats['stages'].values()), stats['seconds'] + 1e-3)
+
+        self.assertTrue(compressor.decompress(self.path('input.huf'), self.path('out.txt')))
+        self.assertEqual(compressor.last_stats.as_dict()['stages']['decode']['bytes'], len(data))
+        self.assertTrue(any(line.startswith('decode') for line in compressor.last_stats.report()))
+
+
+class ArchiveTests(HuffmanTestCase):
+    def test_add_list_extract(self):
+        files = {f'f{i}.csv': make_text(3000 + i * 500, seed=i) for i in range(6)}
+        files['empty.txt'] = b''
+        paths = [self.write_file('src/' + name, data) for name, data in files.items()]
+        archive = self.path('all.hufa')
+
+        for share_tables in (False, True):
+            with self.subTest(share_tables=share_tables):
+                if os.path.exists(archive):
+                    os.remove(archive)
+                compressor = HuffmanCompressor(verbose=False)
+                self.assertTrue(compressor.add_to_archive(archive, paths[:3], share_tables=share_tables))
+                self.assertTrue(compressor.add_to_archive(archive, paths[3:], share_tables=share_tables))
+                # A member with the same name replaces the older one
+                self.assertTrue(compressor.add_to_archive(archive, paths[:1], share_tables=share_tables))
+
+                members = HuffmanCompressor(verbose=False).list_archive(archive)
+                self.assertEqual(sorted(member['name'] for member in members), sorted(files))
+
+                output_dir = self.path(f'out{share_tables}')
+                self.assertTrue(HuffmanCompressor(verbose=False).extract_from_archive(archive, output_dir))
+                for name, data in files.items():
+                    self.assertEqual(self.read_file(os.path.join(output_dir, name)), data)
+
+                selected_dir = self.path(f'selected{share_tables}')
+                self.assertTrue(HuffmanCompressor(verbose=False).extract_from_archive(
+                    archive, selected_dir, ['f2.csv']))
+                self.assertEqual(os.listdir(selected_dir), ['f2.csv'])
+
+    def test_shared_tables_stay_in_archive(self):
+        archive = self.path('all.hufa')
+        first = self.write_file('m1.csv', make_text(20000, seed=1))
+        second = self.write_file('m2.csv', make_text(20000, seed=2))
+        cache = CodeTableCache()
+        for compressor in (HuffmanCompressor(verbose=False), HuffmanCompressor(verbose=False, table_cache=cache)):
+            with self.subTest(table_cache=compressor.table_cache is not None):
+                if os.path.exists(archive):
+                    os.remove(archive)
+                self.assertTrue(compressor.add_to_archive(archive, [first, second], share_tables=True))
+                # A standalone file must not reference a table only the archive holds
+                self.assertTrue(compressor.compress(second, self.path('m2.huf')))
+                self.assertFalse(self.header_flags(self.path('m2.huf')) & FLAG_SHARED_TABLE)
+                self.assertTrue(HuffmanCompressor(verbose=False).decompress(self.path('m2.huf'), self.path('m2.out.csv')))
+                self.assertEqual(self.read_file(self.path('m2.out.csv')), self.read_file(second))
+        self.assertEqual(cache.shared, {})
+
+    def test_failed_add_keeps_archive(self):
+        archive = self.path('all.hufa')
+        first = self.write_file('a.csv', make_text(2000))
+        self.assertTrue(HuffmanCompressor(verbose=False).add_to_archive(archive, [first]))
+        before = self.read_file(archive)
+
+        self.assertFalse(HuffmanCompressor(verbose=False).add_to_archive(archive, [first, self.path('missing.csv')]))
+        self.assertEqual(self.read_file(archive), before)
+        self.assertEqual([member['name'] for member in HuffmanCompressor(verbose=False).list_archive(archive)],
+                         ['a.csv'])
+
+    def test_damaged_directory(self):
+        archive = self.path('all.hufa')
+        source = self.write_file('a.csv', make_text(2000))
+        HuffmanCompressor(verbose=False).add_to_archive(archive, [source])
+        data = bytearray(self.read_file(archive))
+        # Point the trailer into the middle of the directory, then past the end of the file
+        for directory_offset in (len(data) - 20, len(data) - 13, len(data) + 100):
+            data[-12:-4] = directory_offset.to_bytes(8, 'little')
+            bad = self.write_file('bad.hufa', bytes(data))
+            with self.subTest(directory_offset=directory_offset), self.assertRaises(ValueError):
+                HuffmanCompressor(verbose=False).list_archive(bad)
+            self.assertEqual(huffman.main(['list', bad]), 1)
+
+    def test_extract_errors(self):
+        archive = self.path('all.hufa')
+        source = self.write_file('a.csv', make_text(2000))
+        HuffmanCompressor(verbose=False).add_to_archive(archive, [source, source], names=['', 'a.csv'])
+        self.assertFalse(HuffmanCompressor(verbose=False).extract_from_archive(archive, self.path('out'), ['']))
+        # A file where the output directory should be
+        blocked = self.write_file('blocked', b'')
+        self.assertEqual(huffman.main(['extract', '--quiet', archive, blocked, 'a.csv']), 1)
+
+    def test_unsafe_member_name(self):
+        archive = self.path('all.hufa')
+        source = self.write_file('a.csv', make_text(2000))
+        HuffmanCompressor(verbose=False).add_to_archive(archive, [source], names=['../evil.csv'])
+        self.assertFalse(HuffmanCompressor(verbose=False).extract_from_archive(archive, self.path('out')))
+        self.assertFalse(os.path.exists(self.path('evil.csv')))
+
+
+
+
+class MappedInputTests(HuffmanTestCase):
+    def test_chunks_are_views(self):
+        data = make_text(100000, seed=23)
+        compressor = HuffmanCompressor(verbose=False, chunk_size=1 << 14)
+        with compressor.map_input(self.write_file('input.txt', data)) as mapped:
+            chunks = []
+            for chunk in compressor.read_chunks(mapped, start=1000):
+                self.assertIsInstance(chunk, memoryview)
+                chunks.append(bytes(chunk))
+            # Every chunk was released, so the mapping can close
+        self.assertEqual(b''.join(chunks), data[1000:])
+        self.assertEqual(len(chunks[0]), 1 << 14)
+
+    def test_empty_input(self):
+        compressor = HuffmanCompressor(verbose=False)
+        with compressor.map_input(self.write_file('empty.txt', b'')) as mapped:
+            self.assertEqual(list(compressor.read_chunks(mapped)), [])
+
+
+class AppendTests(HuffmanTestCase):
+    def test_append_grows_archive(self):
+        log = self.path('app.log')
+        compressed = self.path('app.huf')
+        data = b''
+        for step in range(4):
+            piece = make_text(30000 + step * 7000, seed=step)
+            data += piece
+            with open(log, 'ab') as file:
+                file.write(piece)
+            compressor = HuffmanCompressor(verbose=False, adaptive=True, chunk_size=1 << 14)
+            self.assertTrue(compressor.append(log, compressed), compressor.last_message)
+            self.assertTrue(HuffmanCompressor(verbose=False).decompress(compressed, self.path('out.log')))
+            self.assertEqual(self.read_file(self.path('out.log')), data)
+        self.assertEqual(HuffmanCompressor(verbose=False).read_range(compressed, 40000, 100), data[40000:40100])
+
+    def test_interrupted_append(self):
+        log = self.path('app.log')
+        compressed = self.path('app.huf')
+        old = make_text(50000, seed=1)
+        self.write_file('app.log', old)
+        self.assertTrue(HuffmanCompressor(verbose=False, adaptive=True, chunk_size=1 << 14).append(log, compressed))
+        before = self.read_file(compressed)
+        with open(compressed, 'rb') as file:
+            file.seek(len(MAGIC))
+            header = HuffmanCompressor(verbose=False).read_header(file)
+            header_size = file.tell()
+        blocks_end = len(before) - INDEX_ENTRY_STRUCT.size * header['block_count'] - TRAILER_STRUCT.size
+
+        with open(log, 'ab') as file:
+            file.write(make_text(40000, seed=2))
+        self.assertTrue(HuffmanCompressor(verbose=False, adaptive=True, chunk_size=1 << 14).append(log, compressed))
+        after = self.read_file(compressed)
+
+        # Killed after writing some of the new blocks or the new index, before the header commit
+        for cut in (blocks_end + 5, blocks_end + 20000, len(after) - 30, len(after)):
+            with self.subTest(cut=cut):
+                interrupted = self.write_file('interrupted.huf', before[:header_size] + after[header_size:cut])
+                self.assertTrue(HuffmanCompressor(verbose=False).verify(interrupted))
+                self.assertTrue(HuffmanCompressor(verbose=False).decompress(interrupted, self.path('out.log')))
+                self.assertEqual(self.read_file(self.path('out.log')), old)
+                self.assertEqual(HuffmanCompressor(verbose=False).read_range(interrupted, 20000, 30000), old[20000:])
+
+    def test_append_rejects_rotated_log(self):
+        log = self.write_file('app.log', make_text(50000, seed=1))
+        compressed = self.path('app.huf')
+        self.assertTrue(HuffmanCompressor(verbose=False, adaptive=True).append(log, compressed))
+        before = self.read_file(compressed)
+
+        self.write_file('app.log', make_text(60000, seed=2))
+        self.assertFalse(HuffmanCompressor(verbose=False, adaptive=True).append(log, compressed))
+        self.write_file('app.log', b'short')
+        self.assertFalse(HuffmanCompressor(verbose=False, adaptive=True).append(log, compressed))
+        self.assertEqual(self.read_file(compressed), before)
+
+    def test_append_needs_adaptive_archive(self):
+        log = self.write_file('app.txt', make_text(5000))
+        compressed = self.path('app.huf')
+        self.assertTrue(HuffmanCompressor(verbose=False).compress(log, compressed))
+        self.assertFalse(HuffmanCompressor(verbose=False, adaptive=True).append(log, compressed))
+
+
+
+if __name__ == '__main__':
+    unittest.main()